@@ -0,0 +1,160 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Rejected(Exception):
+    """A request turned away before any work was done; carries its HTTP status"""
+
+    status = 503
+    retry_after = None
+
+
+class Invalid(Rejected):
+    status = 400
+
+
+class TooLarge(Rejected):
+    status = 413
+
+
+class ClientBusy(Rejected):
+    status = 429
+    retry_after = 1
+
+
+class Overloaded(Rejected):
+    status = 503
+    retry_after = 1
+
+
+class DeadlineExceeded(Exception):
+    """Raised by Deadline.check() once the request has run out of time"""
+
+
+class Deadline:
+    """A time budget, checked cooperatively by long-running loops"""
+
+    __slots__ = ('seconds', 'expires')
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        return None if self.expires is None else self.expires - time.monotonic()
+
+    def check(self):
+        if self.expires is not None and time.monotonic() > self.expires:
+            raise DeadlineExceeded(f"Gave up after {self.seconds:g}s")
+
+
+class Admission:
+    """Decides, from a request's parameters alone, whether to run it.
+
+    A request's cost is the number of notes it asks for. Anything over
+    `max_notes` per piece (or `max_batch_notes` in all) is refused with
+    413, and pieces of fewer than one note with 400. Requests of at
+    least `expensive_notes` hold one of `max_expensive` server-wide slots
+    (503 when all are taken) and one of `per_client` slots for their
+    client (429), so large pieces can never take every thread. Smaller
+    requests skip the slots entirely, so they stay fast however many large
+    ones arrive. Admitted requests get a Deadline of `deadline` seconds.
+
+    Background jobs are counted separately: a client may have at most
+    `per_client_jobs` queued or running (429), so no one client can fill
+    the job queue.
+    """
+
+    def __init__(self, max_notes=50000, max_batch_notes=500000, expensive_notes=2000,
+                 max_expensive=4, per_client=2, deadline=10.0, per_client_jobs=8):
+        self.max_notes = max_notes
+        self.max_batch_notes = max_batch_notes
+        self.expensive_notes = expensive_notes
+        self.max_expensive = max_expensive
+        self.per_client = per_client
+        self.deadline = deadline
+        self.per_client_jobs = per_client_jobs
+        self.expensive = 0
+        self._clients = {}  # client -> expensive requests running
+        self._jobs = {}  # client -> jobs queued or running
+        self._lock = threading.Lock()
+
+    def check(self, lengths, copies=1):
+        """Raise TooLarge unless every piece length and their total are allowed; returns the cost
+
+        Each length stands for `copies` pieces, so a batch of identical
+        pieces can be checked before it is built.
+        """
+        if copies < 1:
+            raise Invalid("At least one piece")
+        cost = 0
+        for length in lengths:
+            if length < 1:
+                raise Invalid("Pieces need at least one note")
+            if length > self.max_notes:
+                raise TooLarge(f"At most {self.max_notes} notes per piece")
+            cost += length * copies
+        if cost > self.max_batch_notes:
+            raise TooLarge(f"At most {self.max_batch_notes} notes per request")
+        return cost
+
+    @contextmanager
+    def admit(self, client, lengths):
+        """Run a block as an admitted request; yields its Deadline
+
+        Raises a Rejected subclass instead if the request can't run now.
+        `lengths` of None is an endless request (a stream that runs until
+        the client hangs up): it always takes the slots and has no deadline.
+        """
+        expensive = lengths is None or self.check(lengths) >= self.expensive_notes
+        if expensive:
+            self._acquire(client)
+        try:
+            yield Deadline(None if lengths is None else self.deadline)
+        finally:
+            if expensive:
+                self._release(client)
+
+    @contextmanager
+    def job(self, client):
+        """Count a block, from submission until the job finishes, against `client`'s jobs
+
+        Raises ClientBusy instead if the client already has `per_client_jobs`.
+        """
+        with self._lock:
+            queued = self._jobs.get(client, 0)
+            if queued >= self.per_client_jobs:
+                raise ClientBusy(f"At most {self.per_client_jobs} jobs at a time")
+            self._jobs[client] = queued + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                queued = self._jobs.pop(client) - 1
+                if queued:
+                    self._jobs[client] = queued
+
+    def _acquire(self, client):
+        with self._lock:
+            running = self._clients.get(client, 0)
+            if running >= self.per_client:
+                raise ClientBusy(f"At most {self.per_client} large requests at a time")
+            if self.expensive >= self.max_expensive:
+                raise Overloaded("Too many large requests in progress")
+            self._clients[client] = running + 1
+            self.expensive += 1
+
+    def _release(self, client):
+        with self._lock:
+            self.expensive -= 1
+            running = self._clients.pop(client) - 1
+            if running:
+                self._clients[client] = running
+
+    def stats(self):
+        with self._lock:
+            return {'expensive': self.expensive, 'clients': len(self._clients),
+                    'max_expensive': self.max_expensive, 'per_client': self.per_client,
+                    'max_notes': self.max_notes, 'deadline': self.deadline,
+                    'jobs': sum(self._jobs.values()), 'per_client_jobs': self.per_client_jobs}
@@ -0,0 +1,276 @@
+"""Offline benchmark suite for the generators, MIDI encoding, audio previews, ingestion and the web app.
+
+    python benchmark.py                          # full run, prints results
+    python benchmark.py --quick                  # smaller sizes
+    python benchmark.py --output results.json    # save results
+    python benchmark.py --compare baseline.json  # flag regressions, exit 1 if any
+
+Everything runs in a temporary directory, so no files land in the repo.
+Each result is the median time per call, in seconds, of as many runs as
+fit in about BUDGET seconds (fast calls are looped, like timeit's
+autorange); HTTP percentiles pool the requests of repeated runs of
+the load. Audio previews also print their real-time factor (seconds of
+audio rendered per second). --compare ignores changes smaller than the
+noise floor, however large the ratio.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO)
+
+FULL_LENGTHS = [10, 100, 1000, 10000, 100000]
+QUICK_LENGTHS = [10, 100, 1000]
+FULL_CORPUS_SIZES = [10, 50, 200]
+QUICK_CORPUS_SIZES = [5, 20]
+BUDGET = 0.2  # seconds spent timing each result
+MIN_SAMPLE = 0.005  # seconds; faster calls are repeated within one sample
+NOISE_FLOOR = 1.0  # milliseconds; smaller slowdowns are never regressions
+HTTP_ROUNDS = 3  # the HTTP load runs at least this often per endpoint,
+HTTP_BUDGET = 2.0  # and until this many seconds, so the percentiles have enough requests
+
+
+def measure(fn, budget=BUDGET):
+    """Median seconds per call of `fn`, sampled for about `budget` seconds
+
+    The first call warms up and is only used when it alone takes the
+    whole budget.
+    """
+    start = time.perf_counter()
+    fn()
+    first = time.perf_counter() - start
+    if first >= budget:
+        return first
+    loops = max(1, int(MIN_SAMPLE / max(first, 1e-7)))
+    samples = []
+    deadline = time.perf_counter() + budget
+    while not samples or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops)
+    return statistics.median(samples)
+
+
+def quiet():
+    # The generators print progress; keep the report readable
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def bench_generation(lengths):
+    from music_generator import SimpleMusicGenerator
+    from music_web import MusicGenerator
+
+    results = {}
+    with quiet():
+        simple = SimpleMusicGenerator()
+        simple.create_sample_data(seed=0)
+        simple.train()
+        web = MusicGenerator(cache_bytes=0)  # measure rendering, not the cache
+    for length in lengths:
+        for method in ('markov', 'best', 'pattern'):
+            with quiet():
+                results[f'generate.simple.{method}.{length}'] = measure(
+                    lambda: simple.generate_ai_music(length, method=method, seed=1))
+        results[f'generate.web.ai.{length}'] = measure(
+            lambda: web.generate_ai_music(length, save=False, seed=1))
+    for name in MusicGenerator.PRESETS:
+        method = getattr(web, f'generate_{name}')
+        results[f'generate.web.{name}'] = measure(lambda: method(save=False))
+    return results
+
+
+def bench_encoding(lengths):
+    from midi_writer import encode_midi
+    from vocab import Vocabulary
+
+    vocab = Vocabulary(['C4', 'E4', 'G4', 'C4.E4.G4', '0.4.7', 'B-3'])
+    rng = random.Random(0)
+    results = {}
+    for length in lengths:
+        events = vocab.events([rng.randrange(len(vocab)) for _ in range(length)])
+        results[f'encode.midi.{length}'] = measure(lambda: encode_midi(events))
+    return results
+
+
+def bench_audio(lengths):
+    import synth
+    from vocab import Vocabulary
+
+    vocab = Vocabulary(['C4', 'E4', 'G4', 'C4.E4.G4', '0.4.7', 'B-3'])
+    rng = random.Random(0)
+    results = {}
+    for length in lengths:
+        if length > 10000:
+            continue  # over an hour of audio
+        notes = synth.prepare(vocab.events([rng.randrange(len(vocab)) for _ in range(length)]))
+        seconds = measure(lambda: b''.join(synth.iter_wav(notes)))
+        audio = synth.total_samples(notes) / synth.SAMPLE_RATE
+        print(f"   {length} notes: {audio:.1f}s of audio in {seconds:.3f}s ({audio / seconds:.0f}x real time)")
+        results[f'audio.preview.{length}'] = seconds
+    return results
+
+
+def write_corpus(directory, files, notes_per_file=200):
+    from midi_writer import write_midi
+    from vocab import Vocabulary
+
+    os.makedirs(directory, exist_ok=True)
+    vocab = Vocabulary(['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'C5', 'C4.E4.G4', '0.4.7', 'B-3'])
+    rng = random.Random(files)
+    for i in range(files):
+        tokens = [rng.randrange(len(vocab)) for _ in range(notes_per_file)]
+        write_midi(vocab.events(tokens), os.path.join(directory, f'piece_{i:05d}.mid'))
+
+
+def bench_ingestion(sizes):
+    from array import array
+    from corpus import ingest_files, load_corpus, midi_paths
+    from vocab import Vocabulary
+
+    results = {}
+    for files in sizes:
+        directory = os.path.join('corpora', str(files))
+        write_corpus(directory, files)
+        paths = midi_paths(directory)
+        for workers in sorted({1, os.cpu_count() or 1}):
+            with quiet():
+                results[f'ingest.parse.{files}files.{workers}workers'] = measure(
+                    lambda: ingest_files(paths, Vocabulary(), array('i'), workers=workers))
+        with quiet():
+            load_corpus(directory, Vocabulary(), array('i'))  # fill the cache
+            results[f'ingest.cached.{files}files'] = measure(
+                lambda: load_corpus(directory, Vocabulary(), array('i')))
+    return results
+
+
+def bench_http(concurrency, requests_per_thread):
+    from music_web import MusicGenerator, create_app
+
+    with quiet():
+        app = create_app(MusicGenerator())
+    endpoints = {
+        'preset': lambda client, i: client.get('/generate/quick'),
+        'ai': lambda client, i: client.get(f'/generate/ai?length=100&seed={i}'),
+        'files': lambda client, i: client.get('/files'),
+    }
+    results = {}
+    for name, call in endpoints.items():
+        latencies = []
+        lock = threading.Lock()
+        total = 0.0
+        run = 0
+        while run < HTTP_ROUNDS or total < HTTP_BUDGET:
+
+            def worker(offset):
+                client = app.test_client()
+                for i in range(requests_per_thread):
+                    start = time.perf_counter()
+                    call(client, (run * concurrency + offset) * requests_per_thread + i)
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+
+            threads = [threading.Thread(target=worker, args=(t,)) for t in range(concurrency)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            total += time.perf_counter() - start
+            run += 1
+        latencies.sort()
+        results[f'http.{name}.p50'] = latencies[len(latencies) // 2]
+        results[f'http.{name}.p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        results[f'http.{name}.seconds_per_request'] = total / len(latencies)
+    app.jobs.shutdown()
+    return results
+
+
+def compare(results, baseline, threshold, floor=NOISE_FLOOR):
+    """Print the change against a baseline; returns the names that regressed
+
+    A result regresses when it is more than `threshold` slower and more
+    than `floor` milliseconds slower.
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old, new = baseline[name], results[name]
+        ratio = new / old if old > 0 else float('inf')
+        flag = ''
+        if ratio > 1 + threshold and (new - old) * 1e3 > floor:
+            flag = '  ✗ REGRESSION'
+            regressions.append(name)
+        print(f"{name:50s} {old * 1e3:10.3f} ms -> {new * 1e3:10.3f} ms  ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='smaller sizes for a fast check')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown ratio above which a result counts as a regression (default 0.25)')
+    parser.add_argument('--noise-floor', type=float, default=NOISE_FLOOR,
+                        help=f'milliseconds a result must slow down by to count (default {NOISE_FLOOR})')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads for the HTTP benchmark')
+    args = parser.parse_args(argv)
+
+    lengths = QUICK_LENGTHS if args.quick else FULL_LENGTHS
+    sizes = QUICK_CORPUS_SIZES if args.quick else FULL_CORPUS_SIZES
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for label, run in [
+                ('generation', lambda: bench_generation(lengths)),
+                ('MIDI encoding', lambda: bench_encoding(lengths)),
+                ('audio previews', lambda: bench_audio(lengths)),
+                ('ingestion', lambda: bench_ingestion(sizes)),
+                ('HTTP', lambda: bench_http(args.concurrency, 10 if args.quick else 50)),
+            ]:
+                print(f"⏱️  Benchmarking {label}...")
+                results.update(run())
+        finally:
+            os.chdir(cwd)
+
+    for name, seconds in sorted(results.items()):
+        print(f"{name:50s} {seconds * 1e3:10.3f} ms")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.time(), 'python': sys.version.split()[0],
+                       'cpus': os.cpu_count(), 'results': results}, f, indent=2, sort_keys=True)
+        print(f"Saved results to {output}")
+
+    if baseline is not None:
+        print(f"\nCompared with {args.compare}:")
+        regressions = compare(results, baseline, args.threshold, args.noise_floor)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""Render a library of AI pieces on every core.
+
+    python bulk_render.py --count 100000 --length 50-200 --seed 0 --output library
+
+Piece i uses seed (--seed + i); with a length range its length is drawn
+from that seed too, so every piece is reproducible: each file is the
+ai_music.mid that SimpleMusicGenerator().generate_ai_music(length,
+method, seed) writes. Files are named by a hash of their contents and
+spread over 256 subdirectories; identical pieces are only written once. Every finished piece is recorded in
+<output>/manifest.jsonl, and running the same command again skips the
+pieces that are already there, so an interrupted run can be resumed.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+MANIFEST = 'manifest.jsonl'
+CHUNK = 64  # pieces per task sent to a worker
+
+_generator = None
+_method = None
+_output = None
+
+
+def parse_lengths(text):
+    """'100' -> (100, 100); '50-200' -> (50, 200)"""
+    low, _, high = text.partition('-')
+    low, high = int(low), int(high or low)
+    if not 0 < low <= high:
+        raise argparse.ArgumentTypeError(f"Invalid length range: {text}")
+    return low, high
+
+
+def piece_length(lengths, seed):
+    low, high = lengths
+    return low if low == high else random.Random(seed).randint(low, high)
+
+
+def load_manifest(output):
+    """(seed, length) of every piece already rendered into `output`"""
+    done = set()
+    path = os.path.join(output, MANIFEST)
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # half-written line from an interrupted run
+                done.add((record['seed'], record['length']))
+    return done
+
+
+def _init_worker(generator, method, output):
+    global _generator, _method, _output
+    _generator, _method, _output = generator, method, output
+
+
+def _render_chunk(pieces):
+    import numpy as np
+    from event_store import EventStore
+    from midi_writer import encode_midi
+
+    records = []
+    for seed, length in pieces:
+        rng = np.random.default_rng(seed)
+        if _method == 'markov':
+            tokens = _generator.sample_markov(length, rng)
+        else:
+            tokens = _generator.sample_tokens(length, rng)
+        data = encode_midi(EventStore.from_tokens(tokens, _generator.vocab))
+        digest = hashlib.sha256(data).hexdigest()
+        filename = os.path.join(digest[:2], f"ai_music_{length}notes_{digest[:12]}.mid")
+        path = os.path.join(_output, filename)
+        duplicate = os.path.exists(path)
+        if not duplicate:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        records.append({'seed': seed, 'length': length, 'filename': filename,
+                        'size': len(data), 'duplicate': duplicate})
+    return records
+
+
+def _chunks(pieces, size):
+    chunk = []
+    for piece in pieces:
+        chunk.append(piece)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def build_generator(method):
+    """The trained generator every worker shares"""
+    from music_generator import SimpleMusicGenerator
+
+    generator = SimpleMusicGenerator()
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator.load_or_create_data(seed=0)  # sample data must not change between resumed runs
+        if method == 'markov':
+            generator.train()
+    return generator
+
+
+def bulk_render(count, lengths, seed=0, output='library', method='markov', workers=None):
+    """Render pieces seed .. seed + count - 1 into `output`; returns a summary dict"""
+    os.makedirs(output, exist_ok=True)
+    done = load_manifest(output)
+
+    def planned():
+        return ((s, piece_length(lengths, s)) for s in range(seed, seed + count))
+
+    skipped = sum(1 for piece in planned() if piece in done)
+    todo = (piece for piece in planned() if piece not in done)
+    remaining = count - skipped
+    print(f"🎵 Rendering {remaining} pieces ({skipped} already done) into {output}/")
+
+    generator = build_generator(method)
+    workers = workers or os.cpu_count() or 1
+    written = duplicates = rendered = 0
+    start = last_report = time.perf_counter()
+    # Loaded and trained once here, then inherited by each worker (copied only where fork isn't available)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(generator, method, output)) as pool, \
+            open(os.path.join(output, MANIFEST), 'a', encoding='utf-8') as manifest:
+        in_flight = deque()
+        chunks = _chunks(todo, CHUNK)
+        while True:
+            while len(in_flight) < 4 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                in_flight.append(pool.submit(_render_chunk, chunk))
+            if not in_flight:
+                break
+            for record in in_flight.popleft().result():
+                manifest.write(json.dumps(record) + '\n')
+                rendered += 1
+                duplicates += record['duplicate']
+                written += not record['duplicate']
+            manifest.flush()
+            now = time.perf_counter()
+            if now - last_report >= 2 or rendered == remaining:
+                last_report = now
+                rate = rendered / (now - start)
+                eta = (remaining - rendered) / rate if rate else 0
+                print(f"  {rendered}/{remaining} ({rendered / max(remaining, 1):.0%}) "
+                      f"{rate:.0f} pieces/s, ETA {eta:.0f}s")
+
+    elapsed = time.perf_counter() - start
+    summary = {'rendered': rendered, 'written': written, 'duplicates': duplicates,
+               'skipped': skipped, 'seconds': elapsed}
+    print(f"✓ {written} files written, {duplicates} duplicates, {skipped} skipped in {elapsed:.1f}s")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, required=True, help='number of pieces')
+    parser.add_argument('--length', type=parse_lengths, default=(100, 100),
+                        help='notes per piece, or a range like 50-200 (default 100)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first piece (default 0)')
+    parser.add_argument('--output', default='library', help='output directory (default library)')
+    parser.add_argument('--method', choices=['markov', 'pattern'], default='markov')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    args = parser.parse_args(argv)
+    bulk_render(args.count, args.length, args.seed, args.output, args.method, args.workers)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
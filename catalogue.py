@@ -0,0 +1,245 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# With `shared`, the index is kept in sync through this file in the directory
+LOG_NAME = '.catalogue.jsonl'
+# The log is rewritten with only the live files once it is this big and mostly history
+COMPACT_BYTES = 1 << 20
+
+
+class FileCatalogue:
+    """In-memory index of the generated files in a directory.
+
+    The directory is scanned once at startup; after that the generator
+    reports each file it writes with add(), so listing never touches the
+    disk. A retention policy (total bytes, file count and/or age in
+    seconds) deletes the oldest files as new ones arrive. `modified` is
+    when the listing last changed, for Last-Modified headers.
+
+    Files are ordered by (modification time in nanoseconds, filename).
+    The pagination cursor is that pair as "<ns>-<filename>", so files
+    whose mtimes tie are neither skipped nor repeated, and cursors mean
+    the same in every process.
+
+    With `shared`, other processes write to the directory too (see
+    serve.py). Every process then appends its additions and deletions
+    to an append-only log in the directory (LOG_NAME, one JSON record per
+    line) and reads the others' new records before answering, which is
+    one stat when nothing has changed. The log is compacted once it is
+    mostly history; appends and compaction take an flock on it.
+    """
+
+    def __init__(self, directory, max_bytes=None, max_files=None, max_age=None, shared=False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age = max_age
+        self.shared = shared
+        self.bytes = 0
+        self.evictions = 0
+        self.modified = time.time()
+        self._entries = {}  # filename -> entry
+        self._mtimes = {}  # filename -> mtime_ns, its key in _order
+        self._order = []  # (mtime_ns, filename), oldest first
+        self._start = 0  # index of the oldest file not yet evicted
+        self._log_path = os.path.join(directory, LOG_NAME)
+        self._log_inode = None  # of the log we have read, and how far
+        self._log_offset = 0
+        self._lock = threading.Lock()
+        self._scan()
+        if shared:
+            self._sync(params_only=True)
+        evicted = self._enforce()
+        if evicted and shared:
+            self._append([{'remove': name} for name in evicted])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, filename):
+        if self.shared:
+            with self._lock:
+                self._sync()
+        return filename in self._entries
+
+    def _scan(self):
+        found = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.mid'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    continue  # deleted since listdir
+                found.append((stat.st_mtime_ns, filename, stat.st_size))
+        for mtime, filename, size in sorted(found):
+            self._record(filename, size, mtime, None)
+
+    def _record(self, filename, size, mtime, params):
+        self._entries[filename] = {'filename': filename, 'size': size, 'created': mtime / 1e9,
+                                   'params': params}
+        self._mtimes[filename] = mtime
+        # Appends, unless another thread's newer file got in first
+        bisect.insort(self._order, (mtime, filename), self._start)
+        self.bytes += size
+        self.modified = time.time()
+
+    def _forget(self, filename):
+        entry = self._entries.pop(filename)
+        mtime = self._mtimes.pop(filename)
+        del self._order[bisect.bisect_left(self._order, (mtime, filename), self._start)]
+        self.bytes -= entry['size']
+        self.modified = time.time()
+
+    def add(self, filename, size, params=None):
+        """Record a file that has just been written"""
+        try:
+            mtime = os.stat(os.path.join(self.directory, filename)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = time.time_ns()
+        with self._lock:
+            if self.shared:
+                self._sync()
+            if filename in self._entries:
+                return
+            self._record(filename, size, mtime, params)
+            records = [{'add': filename, 'size': size, 'mtime': mtime, 'params': params}]
+            records += [{'remove': name} for name in self._enforce()]
+            if self.shared:
+                self._append(records)
+
+    def page(self, cursor=None, limit=50):
+        """Newest files first: returns (entries, next cursor or None)
+
+        Raises ValueError for a cursor that page() didn't hand out.
+        """
+        if cursor is not None:
+            mtime, _, filename = cursor.partition('-')
+            cursor = (int(mtime), filename)
+        with self._lock:
+            if self.shared:
+                self._sync()
+            evicted = self._enforce()
+            if evicted and self.shared:
+                self._append([{'remove': name} for name in evicted])
+            end = len(self._order)
+            if cursor is not None:
+                end = bisect.bisect_left(self._order, cursor, self._start, end)
+            start = max(self._start, end - limit)
+            entries = [dict(self._entries[filename]) for _, filename in reversed(self._order[start:end])]
+            next_cursor = None
+            if start > self._start:
+                mtime, filename = self._order[start]
+                next_cursor = f"{mtime}-{filename}"
+            return entries, next_cursor
+
+    def _over_limit(self):
+        if self.max_files is not None and len(self._entries) > self.max_files:
+            return True
+        if self.max_bytes is not None and self.bytes > self.max_bytes:
+            return True
+        if self.max_age is not None and self._entries:
+            oldest = self._entries[self._order[self._start][1]]
+            return time.time() - oldest['created'] > self.max_age
+        return False
+
+    def _enforce(self):
+        """Delete the oldest files while over the limits; returns their names"""
+        # Files only ever leave from the old end, so _order[_start:] are all live
+        evicted = []
+        while self._entries and self._over_limit():
+            _, filename = self._order[self._start]
+            entry = self._entries.pop(filename)
+            del self._mtimes[filename]
+            self.bytes -= entry['size']
+            self.evictions += 1
+            self.modified = time.time()
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass  # another process got there first
+            self._start += 1
+            evicted.append(filename)
+        if self._start > 1024 and self._start * 2 > len(self._order):
+            del self._order[:self._start]
+            self._start = 0
+        return evicted
+
+    def _sync(self, params_only=False):
+        """Apply the log records written since the last call
+
+        A log whose inode has changed has been compacted: it lists every
+        live file, so the index is rebuilt from it. With `params_only` (at
+        startup, after the scan) it only fills in the params of files
+        the scan found; the scan, not the log, says which files exist.
+        """
+        try:
+            stat = os.stat(self._log_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._log_inode:
+            compacted = self._log_inode is not None
+            self._log_inode = stat.st_ino
+            self._log_offset = 0
+            if compacted:
+                self._entries, self._mtimes, self._order, self._start, self.bytes = {}, {}, [], 0, 0
+                self.modified = time.time()
+        if stat.st_size <= self._log_offset:
+            return
+        with open(self._log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            data = f.read(stat.st_size - self._log_offset)
+        # A record still being appended has no newline yet; it is read next time
+        data = data[:data.rfind(b'\n') + 1]
+        self._log_offset += len(data)
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn by a crash mid-append
+            if 'add' in record:
+                filename = record['add']
+                if filename in self._entries:
+                    if self._entries[filename]['params'] is None:
+                        self._entries[filename]['params'] = record['params']
+                elif not params_only:
+                    self._record(filename, record['size'], record['mtime'], record['params'])
+            elif record.get('remove') in self._entries and not params_only:
+                self._forget(record['remove'])
+
+    def _append(self, records):
+        import fcntl
+
+        data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode('utf-8')
+        while True:
+            with open(self._log_path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(f.fileno()).st_ino != os.stat(self._log_path).st_ino:
+                        continue  # compacted since we opened it; append to the new one
+                except FileNotFoundError:
+                    continue
+                f.write(data)
+                f.flush()
+                size = f.tell()
+                if size > COMPACT_BYTES and size > 4 * self._live_bytes():
+                    self._compact()
+                return
+
+    def _live_bytes(self):
+        return 100 * len(self._entries)  # about one record per live file
+
+    def _compact(self):
+        # Called holding the flock on the current log, so nothing is appended meanwhile
+        self._sync()
+        tmp = f"{self._log_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for mtime, filename in self._order[self._start:]:
+                entry = self._entries[filename]
+                f.write(json.dumps({'add': filename, 'size': entry['size'], 'mtime': mtime,
+                                    'params': entry['params']}, separators=(',', ':')) + '\n')
+        os.replace(tmp, self._log_path)
+        stat = os.stat(self._log_path)
+        self._log_inode, self._log_offset = stat.st_ino, stat.st_size
@@ -0,0 +1,55 @@
+"""Check that importing the library modules stays cheap.
+
+Each module is imported in a fresh interpreter under ``python -X importtime``.
+The check fails if its cumulative import time goes over the budget or if
+it pulls in music21, Flask or NumPy, which must only load on first use.
+"""
+import os
+import subprocess
+import sys
+
+BUDGET_MS = 50
+MODULES = ['music_generator', 'music_web', 'midi_writer', 'midi_reader', 'snapshot', 'live_model', 'admission', 'vocab', 'synth']
+HEAVY = ('music21', 'flask', 'numpy')
+
+
+def measure(module):
+    """Returns (cumulative import time in ms, top-level packages imported)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    cumulative = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, total, name = line.split('|')
+        if not total.strip().isdigit():
+            continue
+        name = name.strip()
+        packages.add(name.split('.')[0])
+        if name == module:
+            cumulative = int(total)
+    return cumulative / 1000, packages
+
+
+def main():
+    failed = False
+    for module in MODULES:
+        ms, packages = measure(module)
+        heavy = sorted(p for p in HEAVY if p in packages)
+        ok = ms <= BUDGET_MS and not heavy
+        failed = failed or not ok
+        note = f" (loads {', '.join(heavy)})" if heavy else ""
+        print(f"{'✓' if ok else '✗'} {module}: {ms:.1f} ms{note}")
+    print(f"Budget: {BUDGET_MS} ms per module")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
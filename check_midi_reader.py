@@ -0,0 +1,111 @@
+"""Check the native MIDI reader against music21.
+
+    python check_midi_reader.py [files or directories...]
+
+Every file is tokenized by midi_reader.read_tokens() and by a full
+music21 parse (corpus.parse_with_music21). The check fails if any file
+gives different symbols; files whose parts only interleave differently
+(see midi_reader) are counted separately. Without arguments it uses the
+.mid files here, the midi_files/ tree and a few generated files with
+humanized timing, overlapping notes and notes that cross barlines.
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import warnings
+from collections import Counter
+
+from corpus import iter_midi_paths, parse_with_music21
+from midi_reader import read_tokens
+
+
+def _varlen(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def humanized_midi(seed, notes=200, ticks_per_quarter=480):
+    """SMF bytes for a random, loosely played two-track piece"""
+    rng = random.Random(seed)
+    tracks = []
+    for channel in (0, 1):
+        events = []
+        tick = 0
+        for _ in range(notes):
+            chord = rng.choice([1, 1, 1, 2, 3])
+            root = rng.randint(36, 84)
+            length = rng.choice([120, 240, 360, 480, 960, 1440])
+            for i in range(chord):
+                start = tick + rng.randint(-20, 20) * (i > 0) + rng.randint(0, 15)
+                end = start + length + rng.randint(-40, 40)
+                pitch = root + rng.choice([0, 3, 4, 7, 12])
+                events.append((max(start, 0), 0x90 | channel, pitch, rng.randint(40, 110)))
+                events.append((max(end, start + 1), 0x80 | channel, pitch, 0))
+            tick += rng.choice([120, 240, 240, 480, 480, 720])
+        events.sort(key=lambda e: (e[0], e[1] & 0xF0 == 0x90))
+        body = bytearray()
+        last = 0
+        for tick, status, pitch, velocity in events:
+            body += _varlen(tick - last) + bytes([status, pitch, velocity])
+            last = tick
+        body += b'\x00\xff\x2f\x00'
+        tracks.append(b'MTrk' + struct.pack('>I', len(body)) + body)
+    header = b'MThd' + struct.pack('>IHHH', 6, 1, len(tracks), ticks_per_quarter)
+    return header + b''.join(tracks)
+
+
+def collect(args, scratch):
+    paths = []
+    for arg in args:
+        paths.extend(iter_midi_paths(arg) if os.path.isdir(arg) else [arg])
+    if not args:
+        paths.extend(sorted(f for f in os.listdir('.') if f.endswith('.mid')))
+        if os.path.isdir('midi_files'):
+            paths.extend(iter_midi_paths('midi_files'))
+        for seed in range(5):
+            path = os.path.join(scratch, f"humanized_{seed}.mid")
+            with open(path, 'wb') as f:
+                f.write(humanized_midi(seed))
+            paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    warnings.filterwarnings('ignore')  # music21 warns about unusual files
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = collect(sys.argv[1:] if argv is None else argv, scratch)
+        matched = reordered = 0
+        music21_time = native_time = 0.0
+        for path in paths:
+            start = time.perf_counter()
+            expected = parse_with_music21(path)
+            music21_time += time.perf_counter() - start
+            start = time.perf_counter()
+            tokens = read_tokens(path)
+            native_time += time.perf_counter() - start
+            if tokens == expected:
+                matched += 1
+            elif Counter(tokens) == Counter(expected):
+                reordered += 1
+            else:
+                print(f"✗ {path}: {len(tokens)} symbols, music21 gives {len(expected)}; "
+                      f"{sum((Counter(tokens) - Counter(expected)).values())} differ")
+    failed = len(paths) - matched - reordered
+    print(f"{'✓' if not failed else '✗'} {matched}/{len(paths)} files match music21 exactly, "
+          f"{reordered} with parts interleaved differently")
+    if native_time > 0:
+        print(f"music21 {music21_time:.2f}s, native {native_time:.3f}s "
+              f"({music21_time / native_time:.0f}x faster)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from vocab import Vocabulary
+
+CACHE_VERSION = 2
+MIDI_EXTENSIONS = ('.mid', '.midi')
+# Files parsed per chunk by stream_corpus(); bounds its memory use
+CHUNK_FILES = 256
+
+
+def iter_midi_paths(directory):
+    """The .mid/.midi files under a directory, subdirectories included, in a stable order.
+
+    Hidden directories (such as the token cache) are skipped.
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for f in sorted(files):
+            if f.lower().endswith(MIDI_EXTENSIONS):
+                yield os.path.join(root, f)
+
+
+def midi_paths(directory):
+    return list(iter_midi_paths(directory))
+
+
+def parse_with_music21(path):
+    """Note and chord symbols of one MIDI file, from a full music21 parse"""
+    from music21 import converter, note, chord
+
+    symbols = []
+    midi = converter.parse(path)
+    for element in midi.flatten().notes:
+        if isinstance(element, note.Note):
+            symbols.append(str(element.pitch))
+        elif isinstance(element, chord.Chord):
+            symbols.append('.'.join(str(n) for n in element.normalOrder))
+    return symbols
+
+
+def parse_midi_file(path):
+    """Tokenize one MIDI file.
+
+    The native reader (midi_reader) is tried first; files it rejects go
+    through music21. Returns (symbols, tokens) where tokens index into
+    the file's own symbol list, so results stay small when sent back
+    from a worker.
+    """
+    from midi_reader import read_tokens
+
+    try:
+        symbols = read_tokens(path)
+    except ValueError:
+        symbols = parse_with_music21(path)
+    vocab = Vocabulary()
+    return vocab.symbols, vocab.encode(symbols)
+
+
+def _parse_or_fail(path):
+    try:
+        return parse_midi_file(path), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _merge(vocab, tokens, symbols, file_tokens):
+    remap = [vocab.intern(symbol) for symbol in symbols]
+    tokens.extend(remap[token] for token in file_tokens)
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ingest_files(paths, vocab, tokens, workers=None, spans=None):
+    """Parse MIDI files into `tokens`, interning symbols into `vocab`.
+
+    Files are parsed in a process pool of `workers` processes (all cores
+    by default, in-process when workers is 1) and merged in the order of
+    `paths`, so the corpus is the same however many workers are used.
+    Returns a list of (path, error) for files that could not be parsed.
+    If `spans` is a dict it receives path -> (start, end) in `tokens`.
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    failures = []
+    before = len(tokens)
+
+    if workers == 1 or len(paths) < 2:
+        results = map(_parse_or_fail, paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunksize = max(1, len(paths) // (workers * 4))
+        results = executor.map(_parse_or_fail, paths, chunksize=chunksize)
+
+    try:
+        for path, (parsed, error) in zip(paths, results):
+            if error is not None:
+                print(f"⚠️  Skipped {path}: {error}")
+                failures.append((path, error))
+                continue
+            first = len(tokens)
+            _merge(vocab, tokens, *parsed)
+            if spans is not None:
+                spans[path] = (first, len(tokens))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - start
+    parsed_count = len(paths) - len(failures)
+    rate = parsed_count / elapsed if elapsed > 0 else 0.0
+    print(f"Parsed {parsed_count}/{len(paths)} files with {workers} worker(s) "
+          f"in {elapsed:.2f}s ({rate:.1f} files/s, {len(tokens) - before} notes)")
+    return failures
+
+
+class TokenCache:
+    """Tokenized corpus on disk.
+
+    tokens.npy holds every cached file's tokens back to back and is
+    memory-mapped on load; manifest.json holds the vocabulary and, per
+    source file, its size, mtime, SHA-1 and slice of tokens.npy. Files
+    that failed to parse are kept under 'failures' with their size,
+    mtime, SHA-1 and error, so they are only retried once they change.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tokens_path = os.path.join(directory, 'tokens.npy')
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+
+    def load(self):
+        """Returns (symbols, tokens, files, failures), empty when there is no usable cache"""
+        empty = ([], np.empty(0, dtype=np.intc), {}, {})
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            tokens = np.load(self.tokens_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return empty
+        if manifest.get('version') != CACHE_VERSION or len(tokens) != manifest.get('count'):
+            return empty
+        return manifest['symbols'], tokens, manifest['files'], manifest.get('failures', {})
+
+    def save(self, symbols, tokens, files, failures=None):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = {'version': CACHE_VERSION, 'count': len(tokens), 'symbols': symbols, 'files': files,
+                    'failures': failures or {}}
+        _replace_atomically(self.tokens_path, lambda f: np.save(f, tokens))
+        _replace_atomically(self.manifest_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+
+
+def _replace_atomically(path, write):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def load_corpus(directory, vocab, tokens, workers=None, cache_dir=None):
+    """Load the MIDI files in `directory` into `tokens`, using the token cache.
+
+    Files whose size and mtime (or, failing that, content hash) match the
+    cache are read from it; only new or modified files are parsed. The
+    cache (``<directory>/.token_cache`` by default) is rewritten when
+    anything changed. Files that failed before are skipped until they
+    change. Returns the list of (path, error) for files that failed to
+    parse, now or before.
+    """
+    start = time.perf_counter()
+    cache = TokenCache(cache_dir or os.path.join(directory, '.token_cache'))
+    symbols, cached, entries, failed = cache.load()
+    remap = np.array([vocab.intern(symbol) for symbol in symbols], dtype=np.intc)
+
+    paths = midi_paths(directory)
+    reused = {}
+    known_failures = {}
+    stale = []
+    for path in paths:
+        name = os.path.relpath(path, directory)
+        stat = os.stat(path)
+        entry = _unchanged(entries.get(name), path, stat)
+        if entry is not None:
+            reused[name] = entry
+            continue
+        entry = _unchanged(failed.get(name), path, stat)
+        if entry is not None:
+            known_failures[name] = entry
+            continue
+        stale.append(path)
+
+    fresh = array('i')
+    spans = {}
+    new_failures = ingest_files(stale, vocab, fresh, workers=workers, spans=spans) if stale else []
+    fresh = np.frombuffer(fresh, dtype=np.intc)
+    for path, error in new_failures:
+        stat = os.stat(path)
+        known_failures[os.path.relpath(path, directory)] = {
+            'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': file_digest(path), 'error': error}
+    failures = [(path, known_failures[name]['error']) for path, name in
+                ((path, os.path.relpath(path, directory)) for path in paths) if name in known_failures]
+
+    # Assemble the corpus in path order, exactly as a cold load would
+    parts = []
+    files = {}
+    offset = 0
+    for path in paths:
+        name = os.path.relpath(path, directory)
+        if name in reused:
+            entry = reused[name]
+            part = remap[cached[entry['start']:entry['end']]]
+        elif path in spans:
+            stat = os.stat(path)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': file_digest(path)}
+            part = fresh[spans[path][0]:spans[path][1]]
+        else:
+            continue
+        files[name] = dict(entry, start=offset, end=offset + len(part))
+        offset += len(part)
+        parts.append(part)
+    corpus = np.concatenate(parts).astype(np.intc) if parts else np.empty(0, dtype=np.intc)
+    tokens.frombytes(corpus.tobytes())
+
+    changed = stale or files.keys() != entries.keys() or known_failures != failed or any(
+        files[name]['mtime'] != entries[name]['mtime'] for name in files)
+    if changed:
+        cache.save(vocab.symbols, corpus, files, known_failures)
+    skipped = len(known_failures) - len(new_failures)
+    print(f"Loaded {len(reused)} cached and {len(spans)} parsed file(s) "
+          f"in {time.perf_counter() - start:.2f}s"
+          + (f", skipped {skipped} that failed before" if skipped else ""))
+    return failures
+
+
+def _unchanged(entry, path, stat):
+    """`entry` (updated to the file's mtime) if the file still has its size and mtime or SHA-1"""
+    if entry is None or entry['size'] != stat.st_size:
+        return None
+    if entry['mtime'] == stat.st_mtime_ns:
+        return entry
+    if entry['sha1'] == file_digest(path):
+        return dict(entry, mtime=stat.st_mtime_ns)
+    return None
+
+
+def _chunks(paths, size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_corpus(directory, vocab, output, on_chunk=None, chunk_files=CHUNK_FILES, workers=None):
+    """Tokenize every MIDI file under `directory` in bounded memory.
+
+    Files are parsed `chunk_files` at a time. Each chunk's tokens are
+    appended to <output>/tokens.bin (raw C ints) and passed to
+    on_chunk(tokens), e.g. MarkovModel.update, before the next chunk is
+    read, so memory use doesn't grow with the corpus. manifest.json
+    records the vocabulary and token count once all files are done; use
+    open_stream() to memory-map the result. Returns the list of
+    (path, error) for files that could not be parsed.
+    """
+    workers = workers or os.cpu_count() or 1
+    total = sum(1 for _ in iter_midi_paths(directory))
+    os.makedirs(output, exist_ok=True)
+    tokens_path = os.path.join(output, 'tokens.bin')
+    manifest_path = os.path.join(output, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)  # the old manifest doesn't describe the new tokens
+    print(f"🎵 Streaming {total} MIDI files from {directory}/ in chunks of {chunk_files}")
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and total > 1 else None
+    failures = []
+    done = count = 0
+    start = time.perf_counter()
+    try:
+        with open(tokens_path, 'wb') as out:
+            for chunk in _chunks(iter_midi_paths(directory), chunk_files):
+                if executor is None:
+                    results = map(_parse_or_fail, chunk)
+                else:
+                    results = executor.map(_parse_or_fail, chunk, chunksize=max(1, len(chunk) // (workers * 4)))
+                tokens = array('i')
+                for path, (parsed, error) in zip(chunk, results):
+                    if error is not None:
+                        print(f"⚠️  Skipped {path}: {error}")
+                        failures.append((path, error))
+                    else:
+                        _merge(vocab, tokens, *parsed)
+                tokens.tofile(out)
+                out.flush()
+                if on_chunk is not None and tokens:
+                    on_chunk(np.frombuffer(tokens, dtype=np.intc))
+                done += len(chunk)
+                count += len(tokens)
+                elapsed = time.perf_counter() - start
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = (total - done) / rate if rate else 0
+                print(f"  {done}/{total} files ({done / max(total, 1):.0%}), {count} notes, "
+                      f"{rate:.1f} files/s, ETA {eta:.0f}s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    manifest = {'version': CACHE_VERSION, 'count': count, 'symbols': vocab.symbols,
+                'files': total, 'failures': failures}
+    _replace_atomically(manifest_path, lambda f: f.write(json.dumps(manifest).encode('utf-8')))
+    print(f"✓ Streamed {total - len(failures)}/{total} files ({count} notes) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return failures
+
+
+def open_stream(output, vocab):
+    """The tokens written by stream_corpus(), memory-mapped, as ids in `vocab`
+
+    Returns None if `output` holds no complete stream.
+    """
+    try:
+        with open(os.path.join(output, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != CACHE_VERSION:
+        return None
+    if not manifest['count']:
+        return np.empty(0, dtype=np.intc)
+    tokens = np.memmap(os.path.join(output, 'tokens.bin'), dtype=np.intc, mode='r', shape=(manifest['count'],))
+    remap = np.array([vocab.intern(symbol) for symbol in manifest['symbols']], dtype=np.intc)
+    if np.array_equal(remap, np.arange(len(remap))):
+        return tokens
+    return remap[tokens]
@@ -0,0 +1,149 @@
+import threading
+import weakref
+
+import numpy as np
+
+from midi_writer import DEFAULT_PROGRAM, DEFAULT_VELOCITY, Event, events_to_stream
+
+# One record per note or chord: 22 bytes, so 100k events take about 2 MB
+EVENT_DTYPE = np.dtype([
+    ('onset', 'f8'),
+    ('duration', 'f8'),
+    ('velocity', 'u1'),
+    ('program', 'u1'),
+    ('chord', 'i4'),  # index into a ChordTable
+])
+
+
+class ChordTable:
+    """Interned pitch sets; id -> tuple of MIDI pitches.
+
+    Events store only the id, so a piece that plays the same chord
+    10,000 times keeps one copy of its pitches. The table is shared
+    between pieces and only ever grows.
+    """
+
+    def __init__(self):
+        self.chords = []
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._lookups = weakref.WeakKeyDictionary()  # vocabulary -> id array
+
+    def __len__(self):
+        return len(self.chords)
+
+    def intern(self, pitches):
+        """Return the id for a pitch tuple, adding it if it is new"""
+        pitches = tuple(pitches)
+        chord = self._ids.get(pitches)
+        if chord is None:
+            with self._lock:
+                chord = self._ids.get(pitches)
+                if chord is None:
+                    chord = len(self.chords)
+                    self.chords.append(pitches)
+                    self._ids[pitches] = chord
+        return chord
+
+    def lookup(self, vocab):
+        """Array mapping each vocabulary id to its chord id"""
+        # Vocabularies only grow, so only new ids need interning
+        lookup = self._lookups.get(vocab)
+        if lookup is None or len(lookup) < len(vocab):
+            known = [] if lookup is None else lookup.tolist()
+            known += [self.intern(pitches) for pitches in vocab.pitches[len(known):]]
+            lookup = self._lookups[vocab] = np.array(known, dtype=np.int32)
+        return lookup
+
+
+# Used by every EventStore that isn't given its own table
+CHORDS = ChordTable()
+
+
+class EventStore:
+    """A piece as one NumPy structured array (see EVENT_DTYPE).
+
+    Iterating yields midi_writer.Event tuples, so a store can go anywhere
+    a list of events can (encode_midi, write_midi, render_midi). The
+    transformations work on whole columns and return new stores; music21
+    objects are only built by to_stream().
+    """
+
+    def __init__(self, array=None, chords=None):
+        self.array = np.zeros(0, dtype=EVENT_DTYPE) if array is None else array
+        self.chords = CHORDS if chords is None else chords
+
+    @classmethod
+    def from_events(cls, events, chords=None):
+        chords = CHORDS if chords is None else chords
+        rows = [(e.onset, e.duration, e.velocity, e.program, chords.intern(e.pitches)) for e in events]
+        return cls(np.array(rows, dtype=EVENT_DTYPE), chords)
+
+    @classmethod
+    def from_tokens(cls, tokens, vocab, duration=1.0, velocity=DEFAULT_VELOCITY,
+                    program=DEFAULT_PROGRAM, chords=None):
+        """Back-to-back events for vocabulary ids, like Vocabulary.events()"""
+        chords = CHORDS if chords is None else chords
+        tokens = np.asarray(tokens, dtype=np.intp)
+        array = np.empty(len(tokens), dtype=EVENT_DTYPE)
+        array['onset'] = np.arange(len(tokens)) * float(duration)
+        array['duration'] = duration
+        array['velocity'] = velocity
+        array['program'] = program
+        array['chord'] = chords.lookup(vocab)[tokens]
+        return cls(array, chords)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __iter__(self):
+        chords = self.chords.chords
+        for onset, duration, velocity, program, chord in self.array.tolist():
+            yield Event(onset, duration, chords[chord], velocity, program)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            onset, duration, velocity, program, chord = self.array[index].tolist()
+            return Event(onset, duration, self.chords.chords[chord], velocity, program)
+        return EventStore(self.array[index], self.chords)
+
+    @property
+    def nbytes(self):
+        return self.array.nbytes
+
+    def transpose(self, semitones):
+        """Shift every pitch by `semitones`; pitches must stay within MIDI range"""
+        used, inverse = np.unique(self.array['chord'], return_inverse=True)
+        # One lookup per distinct chord, then a single gather for all the events
+        moved = []
+        for chord in used.tolist():
+            pitches = tuple(p + semitones for p in self.chords.chords[chord])
+            if min(pitches) < 0 or max(pitches) > 127:
+                raise ValueError(f"Transposing {self.chords.chords[chord]} by {semitones} leaves the MIDI range")
+            moved.append(self.chords.intern(pitches))
+        array = self.array.copy()
+        array['chord'] = np.array(moved, dtype=np.int32)[inverse.reshape(-1)]
+        return EventStore(array, self.chords)
+
+    def stretch(self, factor):
+        """Scale onsets and durations by `factor` (2 plays at half speed)"""
+        if factor <= 0:
+            raise ValueError("Stretch factor must be positive")
+        array = self.array.copy()
+        array['onset'] *= factor
+        array['duration'] *= factor
+        return EventStore(array, self.chords)
+
+    def slice_time(self, start, end=None):
+        """Events starting in [start, end), moved so that `start` becomes 0"""
+        onsets = self.array['onset']
+        keep = onsets >= start
+        if end is not None:
+            keep &= onsets < end
+        array = self.array[keep]
+        array['onset'] -= start
+        return EventStore(array, self.chords)
+
+    def to_stream(self):
+        """The equivalent music21 stream (imports music21)"""
+        return events_to_stream(self)
@@ -0,0 +1,174 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when too many jobs are pending"""
+
+
+class Job:
+    __slots__ = ('id', 'status', 'result', 'error', 'created', 'finished', '_done')
+
+    def __init__(self):
+        self.id = os.urandom(16).hex()
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Block until the job finishes or `timeout` seconds pass; True if finished"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {'id': self.id, 'status': self.status, 'error': self.error,
+                'created': self.created, 'finished': self.finished}
+
+
+class StoredJob(Job):
+    """A job run by another process, read back from its state file"""
+
+    __slots__ = ('_queue',)
+
+    def __init__(self, queue, state):
+        self._queue = queue
+        self._done = threading.Event()
+        self._apply(state)
+
+    def _apply(self, state):
+        self.id = state['id']
+        self.status = state['status']
+        self.error = state['error']
+        self.created = state['created']
+        self.finished = state['finished']
+        self.result = None
+        if state.get('result') is not None:
+            self.result = self._queue.load(state['result'])
+        if self.finished is not None:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        # Poll the state file; the owning process has the real event
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._done.is_set():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            time.sleep(0.1 if remaining is None else min(0.1, remaining))
+            state = self._queue._read(self.id)
+            if state is not None:
+                self._apply(state)
+        return self._done.is_set()
+
+
+class JobQueue:
+    """Runs jobs on a bounded worker pool off the request threads.
+
+    At most `max_pending` jobs may be queued or running; submit() raises
+    QueueFull beyond that so callers can push back (HTTP 429). The last
+    `keep` finished jobs are remembered for status and result lookups.
+
+    With `state_dir`, every job's state is also written there as JSON so
+    that other processes serving the same app (see serve.py) can look it
+    up; `dump` turns a result into JSON data and `load` turns it back.
+    """
+
+    def __init__(self, workers=2, max_pending=32, keep=256, state_dir=None, dump=None, load=None):
+        self.max_pending = max_pending
+        self.keep = keep
+        self.pending = 0
+        self.state_dir = state_dir
+        self.dump = dump
+        self.load = load
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        from concurrent.futures import ThreadPoolExecutor  # not at import time; see check_import_time.py
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def submit(self, fn, *args, **kwargs):
+        job = Job()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"{self.pending} jobs already pending")
+            self.pending += 1
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._publish(job)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.state_dir is not None:
+            state = self._read(job_id)
+            if state is not None:
+                job = StoredJob(self, state)
+        return job
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = 'running'
+        self._publish(job)
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self.pending -= 1
+            try:
+                self._publish(job)
+            finally:
+                job._done.set()
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _publish(self, job):
+        if self.state_dir is None:
+            return
+        state = job.to_dict()
+        state['result'] = self.dump(job.result) if job.status == 'done' else None
+        fd, tmp = tempfile.mkstemp(dir=self.state_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._path(job.id))
+
+    def _read(self, job_id):
+        if not job_id.isalnum():
+            return None  # not one of our ids; keeps lookups inside state_dir
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _forget_finished(self):
+        # Oldest first; pending jobs are never dropped
+        excess = len(self._jobs) - self.keep - self.pending
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].finished is not None:
+                del self._jobs[job_id]
+                excess -= 1
+                if self.state_dir is not None:
+                    try:
+                        os.remove(self._path(job_id))
+                    except FileNotFoundError:
+                        pass
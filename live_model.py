@@ -0,0 +1,119 @@
+import contextlib
+import io
+import os
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+# Where the web app looks for a published snapshot (see snapshot.py)
+DEFAULT_MODEL_PATH = os.environ.get('MUSIC_MODEL', 'model.snap')
+
+# One loaded model: a trained SimpleMusicGenerator and where it came from
+ModelVersion = namedtuple('ModelVersion', ['generator', 'version', 'source', 'loaded_at', 'load_seconds'])
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class LiveModel:
+    """The corpus-trained generator the web app samples from, swapped in place.
+
+    At startup it loads the snapshot at `path`, or without one trains on
+    midi_files/ (or the sample data) like the command line does. After
+    that, current() stats the snapshot at most every `interval` seconds
+    and, when it has changed, loads it on a background thread. Publishing
+    a model is just renaming a new file over that one, as save_snapshot()
+    does; never rewrite it in place, since the processes serving it have
+    it memory-mapped. The swap is one reference assignment: requests
+    that already hold the old version finish with it, and a snapshot
+    that fails to load is reported in status() while the old version
+    keeps serving.
+    """
+
+    def __init__(self, path=None, interval=5.0):
+        self.path = path or DEFAULT_MODEL_PATH
+        self.interval = interval
+        self.reloads = 0
+        self.last_error = None
+        self._signature = _signature(self.path)
+        self._checked = time.monotonic()
+        self._lock = threading.Lock()
+        self._loader = None
+        if self._signature is not None:
+            self._active = self._load_snapshot()
+        else:
+            self._active = self._train()
+
+    def _load_snapshot(self):
+        from music_generator import SimpleMusicGenerator
+
+        start = time.perf_counter()
+        generator = SimpleMusicGenerator()
+        snapshot = generator.load_snapshot(self.path)
+        return ModelVersion(generator, snapshot.version, self.path, time.time(), time.perf_counter() - start)
+
+    def _train(self):
+        import numpy as np
+        from music_generator import SimpleMusicGenerator
+
+        start = time.perf_counter()
+        generator = SimpleMusicGenerator()
+        with contextlib.redirect_stdout(io.StringIO()):
+            generator.load_or_create_data(seed=0)  # the same sample data in every process
+            generator.train()
+        version = f"trained-{zlib.crc32(np.frombuffer(generator.tokens, dtype=np.intc)):08x}"
+        return ModelVersion(generator, version, 'training', time.time(), time.perf_counter() - start)
+
+    def current(self):
+        """The active ModelVersion; hold on to it for the whole request"""
+        if self.interval is not None and time.monotonic() - self._checked >= self.interval:
+            self.reload()
+        return self._active
+
+    def reload(self, wait=False):
+        """Load the snapshot in the background if it changed; with `wait`, until that is done"""
+        with self._lock:
+            self._checked = time.monotonic()
+            loader = self._loader
+            if loader is None:
+                signature = _signature(self.path)
+                if signature is None or signature == self._signature:
+                    return self._active
+                self._signature = signature
+                loader = self._loader = threading.Thread(target=self._swap, daemon=True)
+                loader.start()
+        if wait:
+            loader.join()
+        return self._active
+
+    def _swap(self):
+        from snapshot import SnapshotError
+
+        try:
+            active = self._load_snapshot()
+        except SnapshotError as e:
+            self.last_error = str(e)
+            print(f"⚠️  Keeping model {self._active.version}: {e}")
+        else:
+            self._active = active
+            self.reloads += 1
+            self.last_error = None
+            print(f"🔄 Model {active.version} loaded in {active.load_seconds * 1000:.0f} ms")
+        finally:
+            with self._lock:
+                self._loader = None
+
+    def status(self):
+        active = self.current()
+        generator = active.generator
+        return {'version': active.version, 'source': active.source, 'loaded_at': active.loaded_at,
+                'load_seconds': active.load_seconds, 'path': self.path, 'reloads': self.reloads,
+                'loading': self._loader is not None, 'last_error': self.last_error,
+                'order': generator.model.order, 'contexts': len(generator.model),
+                'vocabulary': len(generator.vocab), 'corpus_notes': len(generator.tokens)}
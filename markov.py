@@ -0,0 +1,312 @@
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+
+class AliasTable:
+    """Walker alias table: draws from a discrete distribution in O(1)"""
+
+    __slots__ = ('outcomes', 'prob', 'alias')
+
+    def __init__(self, outcomes, weights):
+        n = len(outcomes)
+        total = sum(weights)
+        prob = [w * n / total for w in weights]
+        alias = list(range(n))
+        small = [i for i, p in enumerate(prob) if p < 1.0]
+        large = [i for i, p in enumerate(prob) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            alias[s] = l
+            prob[l] -= 1.0 - prob[s]
+            (small if prob[l] < 1.0 else large).append(l)
+        for i in small + large:
+            prob[i] = 1.0  # only rounding error left
+        self.outcomes = list(outcomes)
+        self.prob = prob
+        self.alias = alias
+
+    def draw(self, u1, u2):
+        """Map two uniform [0, 1) numbers to an outcome"""
+        i = int(u1 * len(self.outcomes))
+        return self.outcomes[i] if u2 < self.prob[i] else self.outcomes[self.alias[i]]
+
+
+def _count_rows(windows):
+    """Distinct rows of a 2-D id array and how often each occurs"""
+    base = int(windows.max()) + 1
+    width = windows.shape[1]
+    if base ** width >= 2 ** 63:
+        return np.unique(windows, axis=0, return_counts=True)
+    # Pack each row into one int64 so np.unique can sort a flat array
+    keys = windows[:, 0].copy()
+    for j in range(1, width):
+        keys = keys * base + windows[:, j]
+    keys, counts = np.unique(keys, return_counts=True)
+    rows = np.empty((len(keys), width), dtype=np.int64)
+    for j in range(width - 1, -1, -1):
+        keys, rows[:, j] = np.divmod(keys, base)
+    return rows, counts
+
+
+class _Sampler:
+    """generate(), stream() and generate_batch() for any model with `order`,
+    table(history) and frozen()"""
+
+    def generate(self, length, start=(), rng=None):
+        """Sample `length` ids, continuing from the ids in `start`"""
+        tokens = self.stream(start, rng, block=max(length, 1))
+        return np.fromiter(islice(tokens, length), dtype=np.int32, count=length)
+
+    def stream(self, start=(), rng=None, block=1024):
+        """Sample ids forever, continuing from the ids in `start`
+
+        Random numbers are drawn `block` notes at a time, so memory stays
+        constant; the ids match generate() for the same rng.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        history = deque(start, maxlen=self.order)
+        while True:
+            for u1, u2 in rng.random((block, 2)).tolist():
+                token = self.table(history).draw(u1, u2)
+                history.append(token)
+                yield token
+
+    def generate_batch(self, count, length, start=(), rng=None):
+        """Sample `count` sequences of `length` ids at once, as a (count, length) array
+
+        `start` is one history for every row or a (count, n) array with one
+        per row. Each step is a few array operations over all rows (see
+        FrozenMarkovModel.draw), so the cost of more rows is NumPy work,
+        not Python work. The rows are not the ids generate() would give.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        model = self.frozen()
+        start = np.asarray(start, dtype=np.int64)
+        opening = start.shape[-1] if start.ndim else 0
+        rows = np.empty((count, opening + length), dtype=np.int64)
+        rows[:, :opening] = start
+        draws = rng.random((length, 2, count))
+        for step in range(length):
+            at = opening + step
+            rows[:, at] = model.draw(rows[:, max(at - self.order, 0):at], draws[step, 0], draws[step, 1])
+        return rows[:, opening:].astype(np.int32)
+
+
+class MarkovModel(_Sampler):
+    """Order-N Markov model over vocabulary ids with back-off.
+
+    ``counts[k]`` maps each length-k context (a tuple of ids) to the
+    counts of the tokens that followed it, so ``counts[0][()]`` is the
+    unigram distribution. Alias tables are built lazily per context and
+    dropped when an update changes that context's counts.
+    """
+
+    def __init__(self, order=2):
+        self.order = order
+        self.counts = [{} for _ in range(order + 1)]
+        self._tables = {}
+        self._frozen = None
+
+    def __len__(self):
+        return sum(len(contexts) for contexts in self.counts)
+
+    def update(self, tokens):
+        """Add the transitions in a token sequence (e.g. one more file)"""
+        tokens = np.asarray(tokens, dtype=np.int64)
+        self._frozen = None
+        for k in range(self.order + 1):
+            if len(tokens) <= k:
+                break
+            # Every (context, next) window of length k + 1, counted in one pass
+            windows = np.lib.stride_tricks.sliding_window_view(tokens, k + 1)
+            rows, counts = _count_rows(windows)
+            contexts = self.counts[k]
+            for row, count in zip(rows.tolist(), counts.tolist()):
+                context = tuple(row[:-1])
+                followers = contexts.setdefault(context, {})
+                followers[row[-1]] = followers.get(row[-1], 0) + count
+                self._tables.pop((k, context), None)
+        return self
+
+    def table(self, history):
+        """Alias table for the longest context of `history` seen in training"""
+        for k in range(min(self.order, len(history)), -1, -1):
+            context = tuple(history)[len(history) - k:]
+            followers = self.counts[k].get(context)
+            if followers:
+                key = (k, context)
+                table = self._tables.get(key)
+                if table is None:
+                    table = self._tables[key] = AliasTable(list(followers), list(followers.values()))
+                return table
+        raise ValueError("Model has not been trained")
+
+    def frozen(self):
+        """This model as a FrozenMarkovModel, rebuilt after each update"""
+        if self._frozen is None:
+            base = max(self.counts[0].get((), {0: 0})) + 1
+            self._frozen = FrozenMarkovModel(self.order, base, self.to_arrays(base))
+        return self._frozen
+
+    def to_arrays(self, base):
+        """The model as flat arrays for FrozenMarkovModel; `base` must exceed every id
+
+        Per context length k: ``keys{k}`` holds the contexts packed into
+        int64 (sorted) and ``starts{k}`` where each context's alias table
+        begins in ``outcomes{k}``, ``prob{k}`` and ``alias{k}``.
+        """
+        if base ** self.order >= 2 ** 63:
+            raise ValueError(f"Vocabulary too large to pack order-{self.order} contexts")
+        arrays = {}
+        for k, contexts in enumerate(self.counts):
+            keyed = sorted((_pack(context, base), context) for context in contexts)
+            starts = [0]
+            outcomes, prob, alias = [], [], []
+            for _, context in keyed:
+                followers = contexts[context]
+                # Built exactly like table() builds it, so draws match
+                table = AliasTable(list(followers), list(followers.values()))
+                outcomes += table.outcomes
+                prob += table.prob
+                alias += table.alias
+                starts.append(len(outcomes))
+            arrays[f'keys{k}'] = np.array([key for key, _ in keyed], dtype=np.int64)
+            arrays[f'starts{k}'] = np.array(starts, dtype=np.int64)
+            arrays[f'outcomes{k}'] = np.array(outcomes, dtype=np.int32)
+            arrays[f'prob{k}'] = np.array(prob, dtype=np.float64)
+            arrays[f'alias{k}'] = np.array(alias, dtype=np.int32)
+        return arrays
+
+
+def _pack(context, base):
+    key = 0
+    for token in context:
+        key = key * base + token
+    return key
+
+
+class _TableView:
+    """One context's alias table inside a FrozenMarkovModel's arrays"""
+
+    __slots__ = ('outcomes', 'prob', 'alias', 'start', 'size')
+
+    def __init__(self, outcomes, prob, alias, start, size):
+        self.outcomes = outcomes
+        self.prob = prob
+        self.alias = alias
+        self.start = start
+        self.size = size
+
+    def draw(self, u1, u2):
+        i = self.start + int(u1 * self.size)
+        if u2 >= self.prob[i]:
+            i = self.start + int(self.alias[i])
+        return int(self.outcomes[i])
+
+
+class FrozenMarkovModel(_Sampler):
+    """Read-only MarkovModel over the arrays from MarkovModel.to_arrays().
+
+    The arrays can be views of a memory-mapped file (see snapshot.py), so
+    every process that loads the same file shares one copy. It draws the
+    same ids as the model it was made from.
+    """
+
+    def __init__(self, order, base, arrays):
+        self.order = order
+        self.base = base
+        self.arrays = arrays
+        self._levels = [tuple(arrays[f'{name}{k}'] for name in ('keys', 'starts', 'outcomes', 'prob', 'alias'))
+                        for k in range(order + 1)]
+
+    def __len__(self):
+        return sum(len(keys) for keys, *_ in self._levels)
+
+    def table(self, history):
+        """Alias table for the longest context of `history` seen in training"""
+        history = tuple(history)
+        for k in range(min(self.order, len(history)), -1, -1):
+            context = history[len(history) - k:]
+            if any(not 0 <= token < self.base for token in context):
+                continue
+            keys, starts, outcomes, prob, alias = self._levels[k]
+            key = _pack(context, self.base)
+            i = int(np.searchsorted(keys, key))
+            if i < len(keys) and keys[i] == key:
+                start, end = int(starts[i]), int(starts[i + 1])
+                if end > start:
+                    return _TableView(outcomes, prob, alias, start, end - start)
+        raise ValueError("Model has not been trained")
+
+    def frozen(self):
+        return self
+
+    def to_arrays(self, base):
+        """The arrays this model was made from, with contexts packed in `base`
+
+        `base` is the model's own unless the vocabulary has grown since;
+        repacking keeps the keys sorted, since every id is below both.
+        """
+        if base == self.base:
+            return dict(self.arrays)
+        if base < self.base:
+            raise ValueError(f"Base {base} is below the model's base {self.base}")
+        if base ** self.order >= 2 ** 63:
+            raise ValueError(f"Vocabulary too large to pack order-{self.order} contexts")
+        arrays = dict(self.arrays)
+        for k in range(1, self.order + 1):
+            old = np.array(arrays[f'keys{k}'], dtype=np.int64)
+            keys = np.zeros_like(old)
+            scale = 1
+            for _ in range(k):
+                keys += old % self.base * scale
+                old //= self.base
+                scale *= base
+            arrays[f'keys{k}'] = keys
+        return arrays
+
+    def draw(self, histories, u1, u2):
+        """One id per row of `histories` (an (n, k) id array), all rows at once
+
+        Like table(history).draw(u1, u2) for every row: each row backs off
+        to the longest context seen in training, then takes an alias draw.
+        """
+        n, width = histories.shape
+        found = np.full(n, -1, dtype=np.int64)  # index into starts{k} per row
+        level = np.zeros(n, dtype=np.int64)
+        todo = np.arange(n)
+        for k in range(min(self.order, width), -1, -1):
+            if not len(todo):
+                break
+            keys, starts, *_ = self._levels[k]
+            context = histories[todo, width - k:]
+            valid = np.all((context >= 0) & (context < self.base), axis=1)
+            packed = np.zeros(len(todo), dtype=np.int64)
+            for j in range(k):
+                packed = packed * self.base + np.where(valid, context[:, j], 0)
+            i = np.searchsorted(keys, packed)
+            hit = valid & (i < len(keys))
+            hit[hit] = keys[i[hit]] == packed[hit]
+            hit[hit] = starts[i[hit] + 1] > starts[i[hit]]
+            found[todo[hit]] = i[hit]
+            level[todo[hit]] = k
+            todo = todo[~hit]
+        if len(todo):
+            raise ValueError("Model has not been trained")
+
+        ids = np.empty(n, dtype=np.int64)
+        for k in np.unique(level).tolist():
+            rows = np.flatnonzero(level == k)
+            _, starts, outcomes, prob, alias = self._levels[k]
+            start = starts[found[rows]]
+            size = starts[found[rows] + 1] - start
+            i = start + (u1[rows] * size).astype(np.int64)
+            aliased = u2[rows] >= prob[i]
+            i[aliased] = start[aliased] + alias[i[aliased]]
+            ids[rows] = outcomes[i]
+        return ids
@@ -0,0 +1,203 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; fine enough for cached presets, wide enough for huge pieces
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _key(labels):
+    # Labels come back from JSON as [[name, value], ...]
+    return tuple(tuple(label) for label in labels)
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def state(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, others=()):
+        """Prometheus lines; `others` are state()s of other processes to add in"""
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        values = dict(self.state())
+        for state in others:
+            for key, value in state:
+                key = _key(key)
+                values[key] = values.get(key, 0) + value
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(dict(key))} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def state(self):
+        with self._lock:
+            return [(key, list(series)) for key, series in self._series.items()]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self, others=()):
+        """Prometheus lines; `others` are state()s of other processes to add in"""
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        merged = dict(self.state())
+        for state in others:
+            for key, series in state:
+                key = _key(key)
+                if key in merged:
+                    merged[key] = [a + b for a, b in zip(merged[key], series)]
+                else:
+                    merged[key] = list(series)
+        for key, series in sorted(merged.items()):
+            labels = dict(key)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{_labels(labels, ("le", bound))} {count}')
+            lines.append(f'{self.name}_bucket{_labels(labels, ("le", "+Inf"))} {series[-2]}')
+            lines.append(f'{self.name}_count{_labels(labels)} {series[-2]}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """A set of metrics rendered together in Prometheus text format.
+
+    After share(directory), every process using that directory writes
+    its values there every few seconds (and on publish()), and render()
+    adds up its own live values and the other processes' latest ones.
+    Files of processes that have exited stay, so totals never go down
+    while the server runs; clear the directory when it starts.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._directory = None
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def share(self, directory, interval=5.0):
+        """Aggregate with the other processes that share `directory` (see serve.py)
+
+        Values counted before (inherited from the parent of a forked
+        worker, or its warm-up requests) are dropped, so nothing is counted
+        twice and only real traffic is.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        for metric in self._metrics:
+            metric.reset()
+
+        def publish_forever():
+            while True:
+                time.sleep(interval)
+                self.publish()
+
+        threading.Thread(target=publish_forever, name='metrics', daemon=True).start()
+
+    def publish(self):
+        """Write this process's values for the others to read now"""
+        if self._directory is None:
+            return
+        state = {metric.name: metric.state() for metric in self._metrics}
+        path = os.path.join(self._directory, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def _others(self):
+        """{metric name: [state, ...]} from the other processes' files"""
+        others = {}
+        if self._directory is None:
+            return others
+        own = f"{os.getpid()}.json"
+        for filename in os.listdir(self._directory):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                with open(os.path.join(self._directory, filename), encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, values in state.items():
+                others.setdefault(name, []).append(values)
+        return others
+
+    def render(self):
+        others = self._others()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(others.get(metric.name, ())))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram('music_stage_duration_seconds', 'Time spent in each generation stage')
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds', 'Request latency by endpoint')
+HTTP_REQUESTS = REGISTRY.counter('http_requests_total', 'Requests by endpoint and status')
+ADMISSION_REJECTIONS = REGISTRY.counter('admission_rejections_total', 'Requests refused by admission control, by status')
+
+
+@contextmanager
+def stage(name):
+    """Time a block of generation work as music_stage_duration_seconds{stage=name}"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
@@ -0,0 +1,406 @@
+"""Tokenize Standard MIDI Files without building a music21 score.
+
+read_tokens() gives the note and chord symbols that
+``converter.parse(path).flatten().notes`` gives in corpus.parse_midi_file,
+in the same order. It scans the raw bytes once and then replays only the
+steps of music21's MIDI import that decide which symbols come out and
+where:
+
+- a note-on is paired with the next note-off of the same pitch and channel
+- notes starting and ending within a 16th of each other form a chord
+- offsets and durations snap to the nearest 1/4 or 1/3 of a quarter
+- a note that crosses a barline becomes one tied note per measure
+
+Notes on channel 10 are drums, which music21 reads as unpitched and
+ingestion skips.
+
+One music21 quirk is not replayed: a measure or voice whose cached
+length goes stale when a tie splits one of its notes shifts the
+measures after it. In files with several parts that can interleave the
+parts differently; the symbols themselves are the same.
+"""
+import math
+import mmap
+from bisect import bisect_right
+from fractions import Fraction
+from functools import lru_cache
+
+# Fractions of a quarter that offsets and durations snap to (music21's defaults)
+QUANTIZE_UNITS = (0.25, 1 / 3)
+# Every quantized time is a whole number of these
+STEPS_PER_QUARTER = 12
+# Notes closer than a quarter / this start together (music21: the largest quantization divisor)
+CHORD_DIVISOR = 4
+DRUM_CHANNEL = 10
+# SMPTE timing has no quarter notes; music21 then keeps its default resolution
+DEFAULT_TICKS_PER_QUARTER = 10080
+
+NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+PITCHES = [f"{NAMES[m % 12]}{m // 12 - 1}" for m in range(128)]  # str(pitch) by MIDI number
+
+# Meta events that become score objects in music21; only their times matter here
+_TEMPO, _TIME_SIGNATURE, _KEY_SIGNATURE = 0x51, 0x58, 0x59
+_NAMES = (0x03, 0x04)  # sequence/track name and instrument name
+_CONDUCTOR = 'conductor'  # time/key signatures and tempos, copied into every part
+_INSTRUMENT = 'instrument'
+
+
+@lru_cache(maxsize=None)
+def normal_order(mask):
+    """Normal order of a pitch-class set given as a 12-bit mask, e.g. '0.4.7'
+
+    Forte's packing: the rotation with the smallest span, ties going to
+    the one packed tightest from the left, then to the lowest first pitch
+    class. Gives the same symbol as music21's Chord.normalOrder.
+    """
+    pcs = [pc for pc in range(12) if mask >> pc & 1]
+    best = None
+    for i in range(len(pcs)):
+        rotation = pcs[i:] + pcs[:i]
+        intervals = [(pc - rotation[0]) % 12 for pc in rotation]
+        key = (intervals[-1],) + tuple(intervals[1:-1])
+        if best is None or key < best[0]:
+            best = (key, rotation)
+    return '.'.join(map(str, best[1]))
+
+
+def _symbol(pitches):
+    if len(pitches) == 1:
+        return PITCHES[pitches[0]]
+    mask = 0
+    for pitch in pitches:
+        mask |= 1 << pitch % 12
+    return normal_order(mask)
+
+
+def _varlen(data, pos, end):
+    value = 0
+    while True:
+        if pos >= end:
+            raise IndexError("variable-length number runs past the chunk")
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def _read_track(data, pos, end):
+    """Events of one MTrk chunk: (note events, meta marks)
+
+    Note events are (tick, pitch, channel, velocity, is note-off), with
+    channels counted from 1. Marks are (tick, kind, value) for the events
+    music21 turns into score objects. Unreadable events are skipped the
+    way music21 skips them.
+    """
+    notes = []
+    marks = []
+    tick = 0
+    status = None  # for running status; meta events don't change it
+    while pos < end:
+        delta, pos = _varlen(data, pos, end)
+        if end - pos < 2:
+            break  # music21 ignores a trailing stub
+        first = data[pos]
+        if first < 0x80:
+            kind = 0x90 if status is None else status
+            start = pos - 1  # running status: data[start + 1] is the first data byte
+            new_status = status
+        else:
+            kind = first
+            start = pos
+            new_status = status if first == 0xFF else first
+        size = end - start
+        message = kind & 0xF0
+        if 0x80 <= message <= 0xE0:
+            byte1 = data[start + 1]
+            if message in (0xC0, 0xD0):
+                if byte1 > 127:
+                    continue  # rejected; the status byte is re-read as a delta time
+                if message == 0xC0:
+                    marks.append((tick + delta, _INSTRUMENT, byte1))
+                length = 2
+            else:
+                if message in (0x80, 0x90):
+                    velocity = data[start + 2] if size > 2 else 0
+                    notes.append((tick + delta, byte1, (kind & 0x0F) + 1, velocity,
+                                  message == 0x80 or velocity == 0))
+                length = 3
+        elif kind in (0xF0, 0xF7):
+            length, body = _varlen(data, start + 1, end)
+            length += body - start
+        elif kind == 0xFF:
+            meta = data[start + 1]
+            length, body = _varlen(data, start + 2, end)
+            if meta == _TIME_SIGNATURE:
+                value = data[body:body + length]
+                if len(value) < 2 or value[0] == 0:
+                    raise ValueError(f"Invalid time signature at tick {tick + delta}")
+                marks.append((tick + delta, _TIME_SIGNATURE, (value[0], 2 ** value[1])))
+            elif meta in (_TEMPO, _KEY_SIGNATURE):
+                marks.append((tick + delta, _CONDUCTOR, None))
+            elif meta in _NAMES:
+                marks.append((tick + delta, _INSTRUMENT, None))
+            length += body - start
+        else:
+            continue  # unknown status: skipped like a rejected event
+        tick += delta
+        status = new_status
+        pos = min(start + length, end)
+    return notes, marks
+
+
+def read_smf(data):
+    """(ticks per quarter, tracks) from the bytes of a format 0 or 1 MIDI file"""
+    try:
+        if data[:4] != b'MThd' or int.from_bytes(data[4:8], 'big') != 6:
+            raise ValueError("Not a MIDI file")
+        midi_format = int.from_bytes(data[8:10], 'big')
+        if midi_format not in (0, 1):
+            raise ValueError(f"Cannot read MIDI format {midi_format}")
+        count = int.from_bytes(data[10:12], 'big')
+        division = int.from_bytes(data[12:14], 'big')
+        if division & 0x8000:
+            if division & 0xFF not in (24, 25, 29, 30):
+                raise ValueError(f"Cannot read ticks per frame: {division & 0xFF}")
+            ticks_per_quarter = DEFAULT_TICKS_PER_QUARTER
+        else:
+            ticks_per_quarter = division & 0x7FFF
+        if count == 0:
+            raise ValueError("No tracks")
+        tracks = []
+        pos = 14
+        for _ in range(count):
+            if data[pos:pos + 4] != b'MTrk':
+                raise ValueError("Missing MTrk chunk")
+            length = int.from_bytes(data[pos + 4:pos + 8], 'big')
+            end = min(pos + 8 + length, len(data))
+            tracks.append(_read_track(data, pos + 8, end))
+            pos = end
+    except IndexError:
+        raise ValueError("Truncated MIDI data") from None
+    return ticks_per_quarter, tracks
+
+
+@lru_cache(maxsize=65536)
+def _quantize(target, zero_allowed=True, gap=None):
+    """Nearest multiple of 1/4 or 1/3 of a quarter, in steps (see Stream.quantize)
+
+    With `gap` (steps to the next onset), durations prefer the unit that
+    doesn't leave a gap before it.
+    """
+    gap_ql = 0.0 if gap is None else gap / STEPS_PER_QUARTER
+    best = None
+    for unit in QUANTIZE_UNITS:
+        multiple = math.floor(target / unit)
+        low = unit * multiple
+        if low <= target <= low + unit / 2.0:
+            match, error = low, round(target - low, 7)
+        else:
+            match = unit * (multiple + 1)
+            error = round(match - target, 7)
+        if not zero_allowed and match == 0.0:
+            match = unit
+            error = abs(round(target - match, 7))
+        remaining = 0.0 if gap_ql % unit == 0 else max(gap_ql - match, 0.0)
+        candidate = (remaining, error, unit, match)
+        if best is None or candidate < best:
+            best = candidate
+    return round(best[3] * STEPS_PER_QUARTER)
+
+
+def _pair_notes(events):
+    """(on, off, pitch, channel) per note, in onset order"""
+    notes = []
+    off_ticks = {}
+    for tick, pitch, channel, velocity, is_off in reversed(events):
+        if is_off:
+            off_ticks[pitch, channel] = tick
+        elif (pitch, channel) in off_ticks:
+            notes.append((tick, off_ticks[pitch, channel], pitch, channel))
+    notes.reverse()
+    return notes
+
+
+def _group_chords(notes, ticks_per_quarter):
+    """Returns ([(on tick, duration ticks, pitches, drums)], voices needed)"""
+    tolerance = ticks_per_quarter / CHORD_DIVISOR
+    gathered = [False] * len(notes)
+    groups = []
+    voices = False
+    for i, (on, off, pitch, channel) in enumerate(notes):
+        if gathered[i]:
+            continue
+        members = [notes[i]]
+        for j in range(i + 1, len(notes)):
+            other = notes[j]
+            if abs(other[0] - on) >= tolerance:
+                break
+            if abs(other[1] - off) > tolerance:
+                voices = True
+                continue
+            members.append(other)
+            gathered[j] = True
+        last = members[-1]  # music21 times a chord by its last note
+        groups.append((on, last[1] - last[0], tuple(m[2] for m in members),
+                       any(m[3] == DRUM_CHANNEL for m in members)))
+    return groups, voices
+
+
+def _bars(meters, end):
+    """Measure start times (in steps) covering [0, end]"""
+    at = [offset for offset, _ in meters]
+    starts = [0]
+    o = 0
+    while True:
+        numerator, denominator = meters[bisect_right(at, o) - 1][1]
+        o += Fraction(4 * STEPS_PER_QUARTER * numerator, denominator)
+        if o >= end:
+            return starts, o
+        starts.append(o)
+
+
+class _Element:
+    __slots__ = ('offset', 'duration', 'symbol', 'grace', 'order', 'voice')
+
+    def __init__(self, offset, duration, symbol, grace, order, voice=None):
+        self.offset = offset
+        self.duration = duration
+        self.symbol = symbol  # None for drums
+        self.grace = grace
+        self.order = order  # insertion order, which breaks ties between equal offsets
+        self.voice = voice  # index, or None when directly in the measure
+
+
+def _rank(e):
+    """Position among notes at the same offset: voices in order, then notes outside voices"""
+    return (math.inf if e.voice is None else e.voice, e.order)
+
+
+def _make_voices(elements):
+    """Spread overlapping notes over voices, first fit (Measure.makeVoices)"""
+    spans = sorted((e.offset, e.offset + e.duration) for e in elements)
+    if not any(spans[k + 1][0] < spans[k][1] for k in range(len(spans) - 1)):
+        return False
+    ends = []
+    for e in elements:
+        for v, voice_end in enumerate(ends):
+            if voice_end <= e.offset:
+                break
+        else:
+            v = len(ends)
+            ends.append(0)
+        e.voice = v
+        ends[v] = max(ends[v], e.offset + e.duration)
+    return True
+
+
+def _part_elements(track, ticks_per_quarter, conductor):
+    """The notes of one track as music21 lays them out: [(offset, grace, rank, symbol)]"""
+    events, marks = track
+    groups, voices_required = _group_chords(_pair_notes(events), ticks_per_quarter)
+    if not groups:
+        return []
+
+    mark_offsets = [_quantize(tick / ticks_per_quarter) for tick, _, _ in marks]
+    offsets = [_quantize(on / ticks_per_quarter) for on, _, _, _ in groups]
+    onsets = sorted(set(mark_offsets + offsets))
+    elements = []
+    for index, ((on, ticks, pitches, drums), offset) in enumerate(zip(groups, offsets)):
+        grace = ticks == 0
+        later = bisect_right(onsets, offset)
+        gap = onsets[later] - offset if later < len(onsets) else None
+        duration = _quantize(ticks / ticks_per_quarter, grace, gap)
+        elements.append(_Element(offset, duration, None if drums else _symbol(pitches), grace, index))
+    elements.sort(key=lambda e: (e.offset, not e.grace, e.order))
+
+    # Measures follow the conductor's time signatures if it has any, else the track's own
+    own = [(offset, value) for offset, (_, kind, value) in zip(mark_offsets, marks)
+           if kind == _TIME_SIGNATURE]
+    meters = sorted(conductor['meters'] or own, key=lambda m: m[0])
+    if not meters or meters[0][0] > 0:
+        meters.insert(0, (0, (4, 4)))
+    end = max([e.offset + e.duration for e in elements] + mark_offsets + conductor['offsets'])
+    starts, last_end = _bars(meters, end)
+    measures = [[] for _ in starts]
+    voiced = [False] * len(starts)
+    after = []  # zero-length notes at the very end belong to no measure
+    for e in elements:
+        m = bisect_right(starts, e.offset) - 1
+        if e.offset >= last_end:
+            after.append(e)
+            continue
+        measures[m].append(e)
+    if voices_required:
+        voiced = [_make_voices(measure) for measure in measures]
+
+    # Ties: whatever sticks out of a measure moves on into the next one
+    ends = starts[1:] + [last_end]
+    order = len(elements)
+    pieces = []
+    for m, measure in enumerate(measures):
+        bar_end = ends[m]
+        was_voiced = voiced[m]
+        next_voiced = m + 1 < len(measures) and voiced[m + 1]
+        measure.sort(key=lambda e: (_rank(e)[0], e.offset, not e.grace, e.order))
+        for e in measure:
+            pieces.append(e)
+            if was_voiced and e.voice is None:
+                continue  # only notes inside voices are split
+            overshoot = e.offset + e.duration - bar_end
+            if overshoot <= 0 or m + 1 == len(measures):
+                continue
+            e.duration = bar_end - e.offset
+            if next_voiced:
+                voice = None if was_voiced else 0
+            elif was_voiced:
+                voiced[m + 1] = True  # moveNotesToVoices: everything goes into voice 0
+                for other in measures[m + 1]:
+                    other.voice = 0
+                voice = 0
+            else:
+                voice = None
+            measures[m + 1].append(_Element(bar_end, overshoot, e.symbol, False, order, voice))
+            order += 1
+
+    return ([(e.offset, e.grace, _rank(e), e.symbol) for e in pieces]
+            + [(e.offset, e.grace, (math.inf, math.inf), e.symbol) for e in after])
+
+
+def tokenize_smf(data):
+    """Note and chord symbols from MIDI file bytes, in music21's order"""
+    ticks_per_quarter, tracks = read_smf(data)
+    conductor = {'meters': [], 'offsets': []}
+    found = []
+    part = 0
+    for track in tracks:
+        events, marks = track
+        if any(not is_off for *_, is_off in events):
+            for offset, grace, rank, symbol in _part_elements(track, ticks_per_quarter, conductor):
+                found.append((offset, not grace, part, rank, symbol))
+            part += 1
+        else:
+            # Tracks without notes feed the conductor for the tracks after them
+            for tick, kind, value in marks:
+                offset = _quantize(tick / ticks_per_quarter)
+                if kind == _TIME_SIGNATURE:
+                    conductor['meters'].append((offset, value))
+                    conductor['offsets'].append(offset)
+                elif kind == _CONDUCTOR:
+                    conductor['offsets'].append(offset)
+    found.sort(key=lambda item: item[:4])
+    return [symbol for *_, symbol in found if symbol is not None]
+
+
+def read_tokens(path):
+    """Note and chord symbols of a MIDI file, like music21's flatten().notes"""
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            data = b''
+        try:
+            return tokenize_smf(data)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
@@ -0,0 +1,151 @@
+import struct
+from collections import namedtuple
+
+# Same resolution, tempo and meter music21 writes for a plain Stream
+TICKS_PER_QUARTER = 10080
+DEFAULT_TEMPO = 500000  # microseconds per quarter note (120 bpm)
+DEFAULT_VELOCITY = 90
+DEFAULT_PROGRAM = 0  # Acoustic Grand Piano
+
+Event = namedtuple('Event', ['onset', 'duration', 'pitches', 'velocity', 'program'])
+
+_STEPS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+_ALTERS = {'#': 1, '-': -1, 'b': -1}
+
+
+def parse_pitch(name):
+    """Convert a music21-style pitch ('C4', 'B-3', 'F#5' or '7') to a MIDI number"""
+    name = name.strip()
+    if not name:
+        raise ValueError("Empty pitch name")
+    if name.isdigit():
+        # music21 reads 0-11 as a pitch class in octave 4, anything else as MIDI
+        value = int(name)
+        return 60 + value if value < 12 else value
+
+    step = _STEPS.get(name[0].upper())
+    if step is None:
+        raise ValueError(f"Invalid pitch name: {name}")
+    i = 1
+    alter = 0
+    while i < len(name) and name[i] in _ALTERS:
+        alter += _ALTERS[name[i]]
+        i += 1
+    octave = name[i:]
+    if octave and not octave.lstrip('-').isdigit():
+        raise ValueError(f"Invalid pitch name: {name}")
+    octave = int(octave) if octave else 4
+    midi = 12 * (octave + 1) + step + alter
+    if not 0 <= midi <= 127:
+        raise ValueError(f"Pitch out of MIDI range: {name}")
+    return midi
+
+
+def parse_symbol(symbol):
+    """Return the MIDI pitches of a note ('C4') or chord ('C4.E4.G4', '0.4.7') symbol"""
+    return tuple(parse_pitch(p) for p in symbol.split('.'))
+
+
+def make_event(pitches, onset, duration=1.0, velocity=DEFAULT_VELOCITY, program=DEFAULT_PROGRAM):
+    if isinstance(pitches, int):
+        pitches = (pitches,)
+    return Event(float(onset), float(duration), tuple(pitches), velocity, program)
+
+
+def _varlen(value):
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        out.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(out)
+
+
+def _chunk(tag, data):
+    return tag + struct.pack('>I', len(data)) + data
+
+
+def _ticks(quarter_length):
+    return int(round(quarter_length * TICKS_PER_QUARTER))
+
+
+def _conductor_track():
+    data = bytearray()
+    data += b'\x00\xff\x51\x03' + DEFAULT_TEMPO.to_bytes(3, 'big')
+    data += b'\x00\xff\x58\x04\x04\x02\x18\x08'  # 4/4
+    data += _varlen(TICKS_PER_QUARTER) + b'\xff\x2f\x00'
+    return _chunk(b'MTrk', bytes(data))
+
+
+def _note_track(events, channel=0):
+    # (tick, note-offs before note-ons, order of appearance, message)
+    messages = []
+    order = 0
+    program = DEFAULT_PROGRAM
+    for event in events:
+        start = _ticks(event.onset)
+        end = start + _ticks(event.duration)
+        if event.program != program:
+            messages.append((start, 0, order, bytes([0xC0 | channel, event.program & 0x7F])))
+            program = event.program
+            order += 1
+        for pitch in event.pitches:
+            messages.append((start, 1, order, bytes([0x90 | channel, pitch, event.velocity])))
+            messages.append((end, 0, order, bytes([0x80 | channel, pitch, 0])))
+            order += 1
+    messages.sort(key=lambda m: (m[0], m[1], m[2]))
+
+    data = bytearray(b'\x00\xff\x03\x00')  # empty track name
+    if messages:  # music21 leaves it out of a track without notes
+        data += bytes([0x00, 0xE0 | channel, 0x00, 0x40])  # centred pitch bend
+    last = 0
+    for tick, _, _, message in messages:
+        data += _varlen(tick - last)
+        data += message
+        last = tick
+    data += _varlen(TICKS_PER_QUARTER) + b'\xff\x2f\x00'
+    return _chunk(b'MTrk', bytes(data))
+
+
+def encode_midi(events):
+    """Encode a list of events as the bytes of a format 1 Standard MIDI File"""
+    header = _chunk(b'MThd', struct.pack('>HHH', 1, 2, TICKS_PER_QUARTER))
+    return header + _conductor_track() + _note_track(sorted(events, key=lambda e: e.onset))
+
+
+def events_to_stream(events):
+    """Build the equivalent music21 stream (slow path, kept for compatibility)"""
+    from music21 import note, chord, stream, instrument
+
+    s = stream.Stream()
+    for event in events:
+        notes = []
+        for pitch in event.pitches:
+            n = note.Note()
+            n.pitch.midi = pitch
+            n.storedInstrument = instrument.instrumentFromMidiProgram(event.program)
+            notes.append(n)
+        element = notes[0] if len(notes) == 1 else chord.Chord(notes)
+        element.quarterLength = event.duration
+        element.volume.velocity = event.velocity
+        s.insert(event.onset, element)
+    return s
+
+
+def render_midi(events, use_music21=False):
+    """The .mid file bytes for events, through music21 only when asked to"""
+    if use_music21:
+        from music21 import midi
+
+        return midi.translate.streamToMidiFile(events_to_stream(events)).writestr()
+    return encode_midi(events)
+
+
+def write_midi(events, fp, use_music21=False):
+    """Write events to a .mid file, through music21 only when asked to"""
+    if use_music21:
+        events_to_stream(events).write('midi', fp=fp)
+    else:
+        with open(fp, 'wb') as f:
+            f.write(encode_midi(events))
+    return fp
@@ -1,42 +1,63 @@
 import os
-import numpy as np
-from music21 import converter, instrument, note, chord, stream
-import pickle
-
-print("=== AI Music Generator ===")
+from array import array
+import metrics
+from midi_writer import write_midi
+from vocab import Vocabulary
 
 class SimpleMusicGenerator:
-    def __init__(self):
-        self.notes = []
+    def __init__(self, use_music21=False):
+        self.vocab = Vocabulary()
+        self.tokens = array('i')  # the corpus, as vocabulary ids
+        self.use_music21 = use_music21  # opt in to the slower music21 writer
+        self.failures = []  # (path, error) for MIDI files that could not be parsed
+        self.model = None
+        self._scorer = None  # (model, scoring.PhraseScorer) for method='best'
+    
+    @property
+    def notes(self):
+        """The corpus as note/chord symbols"""
+        return self.vocab.decode(self.tokens)
+    
+    @notes.setter
+    def notes(self, symbols):
+        self.tokens = self.vocab.encode(symbols)
+    
+    def add_note(self, symbol):
+        self.tokens.append(self.vocab.intern(symbol))
+        
+    def load_or_create_data(self, workers=None, use_cache=True, seed=None):
+        """Load MIDI files or create sample data
+        
+        MIDI files are parsed in parallel across `workers` processes
+        (all cores by default); files that fail are reported and kept
+        in self.failures. With `use_cache`, tokens are kept in
+        midi_files/.token_cache and only new or changed files are parsed.
+        """
+        from corpus import ingest_files, iter_midi_paths, load_corpus, midi_paths
         
-    def load_or_create_data(self):
-        """Load MIDI files or create sample data"""
         print("Preparing music data...")
         
-        # If midi_files folder exists, try to load files
-        if os.path.exists("midi_files") and any(file.endswith('.mid') for file in os.listdir("midi_files")):
+        # If midi_files folder exists, try to load files (subfolders included)
+        if os.path.exists("midi_files") and next(iter_midi_paths("midi_files"), None):
             print("Loading MIDI files...")
-            for file in os.listdir("midi_files"):
-                if file.endswith(".mid"):
-                    try:
-                        midi = converter.parse(os.path.join("midi_files", file))
-                        for element in midi.flat.notes:
-                            if isinstance(element, note.Note):
-                                self.notes.append(str(element.pitch))
-                            elif isinstance(element, chord.Chord):
-                                self.notes.append('.'.join(str(n) for n in element.normalOrder))
-                    except:
-                        continue
+            if use_cache:
+                self.failures = load_corpus("midi_files", self.vocab, self.tokens, workers=workers)
+            else:
+                self.failures = ingest_files(midi_paths("midi_files"), self.vocab, self.tokens, workers=workers)
         else:
             # Create sample training data
             print("Creating sample music data...")
-            self.create_sample_data()
+            self.create_sample_data(seed)
             
-        print(f"Loaded {len(self.notes)} music notes")
-        return self.notes
+        print(f"Loaded {len(self.tokens)} music notes")
+        return self.tokens
     
-    def create_sample_data(self):
+    def create_sample_data(self, seed=None):
         """Create sample music patterns for training"""
+        import numpy as np
+        
+        rng = np.random.default_rng(seed)
+        
         # C major scale patterns
         scales = [
             ['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'C5'],  # Ascending
@@ -49,82 +70,251 @@ class SimpleMusicGenerator:
         # Create varied patterns
         for pattern in scales:
             for _ in range(10):
-                self.notes.extend(pattern)
-                self.notes.append(np.random.choice(chords))
+                self.tokens.extend(self.vocab.encode(pattern))
+                self.add_note(rng.choice(chords))
                 
         # Add some random variations
         for _ in range(50):
-            self.notes.append(np.random.choice(['C4', 'E4', 'G4', 'C5', 'E5', 'G5']))
+            self.add_note(rng.choice(['C4', 'E4', 'G4', 'C5', 'E5', 'G5']))
             
         print("Created sample music patterns")
     
-    def generate_ai_music(self, length=100):
-        """Generate music using simple AI patterns"""
-        print("Generating AI music...")
+    def train(self, order=2):
+        """Fit an order-N Markov model to the corpus
         
-        if not self.notes:
+        Call self.model.update(tokens) to add more material later.
+        """
+        import numpy as np
+        from markov import MarkovModel
+        
+        if not len(self.tokens):
             self.load_or_create_data()
-            
-        # Create a new stream
-        s = stream.Stream()
+        print(f"Training order-{order} Markov model...")
+        self.model = MarkovModel(order).update(np.frombuffer(self.tokens, dtype=np.intc))
+        print(f"Learned {len(self.model)} contexts")
+        return self.model
+    
+    def train_streaming(self, directory="midi_files", order=2, chunk_files=None, workers=None):
+        """Train on a corpus too large for memory, one chunk of files at a time
         
-        # Use the learned patterns to generate music
-        current_pattern = self.notes[:10]  # Start with beginning pattern
+        Tokens are written to <directory>/.token_stream as they are parsed
+        and the Markov model is updated after every chunk, so memory use
+        stays flat however many files there are. Afterwards self.tokens
+        is the memory-mapped token file. Transitions between the last notes
+        of one chunk and the first of the next are not counted.
+        """
+        from corpus import CHUNK_FILES, open_stream, stream_corpus
+        from markov import MarkovModel
         
-        for i in range(length):
-            # Choose next note based on simple probability
-            if i < len(current_pattern):
-                next_note = current_pattern[i]
-            else:
-                # Pick randomly from learned notes, favoring recent patterns
-                if np.random.random() > 0.7 and len(current_pattern) > 0:
-                    next_note = np.random.choice(current_pattern)
-                else:
-                    next_note = np.random.choice(self.notes)
-                
-                # Update current pattern
-                current_pattern.append(next_note)
-                if len(current_pattern) > 8:
-                    current_pattern.pop(0)
+        output = os.path.join(directory, '.token_stream')
+        self.model = MarkovModel(order)
+        self.failures = stream_corpus(directory, self.vocab, output, on_chunk=self.model.update,
+                                      chunk_files=chunk_files or CHUNK_FILES, workers=workers)
+        self.tokens = open_stream(output, self.vocab)
+        print(f"Learned {len(self.model)} contexts")
+        return self.model
+    
+    def save_snapshot(self, path):
+        """Write the vocabulary, corpus and Markov model to one file (see snapshot.py)"""
+        from snapshot import save_snapshot
+        
+        if self.model is None:
+            self.train()
+        save_snapshot(path, self.vocab, self.tokens, self.model)
+        print(f"✓ Snapshot saved: {path}")
+    
+    def load_snapshot(self, path, verify=True):
+        """Use a snapshot instead of loading and training
+        
+        The corpus and model stay memory-mapped read-only, so processes
+        loading the same file share them. Raises snapshot.SnapshotError
+        for a damaged or outdated file. Returns the snapshot.Snapshot.
+        """
+        from snapshot import load_snapshot
+        
+        snapshot = load_snapshot(path, verify)
+        self.vocab, self.tokens, self.model = snapshot.vocab, snapshot.tokens, snapshot.model
+        return snapshot
+    
+    def sample_markov(self, length, rng=None):
+        """Draw `length` token ids from the Markov model
+        
+        The piece opens with the first notes of the corpus and continues
+        with one O(1) alias-table draw per note.
+        """
+        import numpy as np
+        
+        if self.model is None:
+            self.train()
+        opening = np.frombuffer(self.tokens, dtype=np.intc)[:min(self.model.order, length)]
+        rest = self.model.generate(length - len(opening), start=opening.tolist(), rng=rng)
+        return np.concatenate([opening, rest]).astype(np.int32)
+    
+    def sample_tokens(self, length, rng=None):
+        """Draw `length` token ids from the corpus in one vectorized pass.
+        
+        The piece opens with the first notes of the corpus; after that each
+        note is picked from the recent window 30% of the time and from the
+        whole corpus otherwise. The window is the last few generated notes,
+        so a window pick is a pointer back into the output, which lets the
+        whole sequence be resolved with array operations.
+        """
+        import numpy as np
+        
+        if rng is None:
+            rng = np.random.default_rng()
+        return next(self._pattern_blocks(rng, length))
+    
+    def _pattern_blocks(self, rng, block):
+        """sample_tokens() as an endless series of `block`-sized arrays"""
+        import numpy as np
+        
+        corpus = np.frombuffer(self.tokens, dtype=np.intc)
+        opening = min(len(corpus), 10)
+        recent = np.empty(0, dtype=np.int32)  # enough of the previous block for any window pick
+        start = 0
+        while True:
+            # All random decisions at once: window-or-corpus, window slot, corpus index.
+            # Drawn note by note, so the notes don't depend on the block size
+            draws = rng.random((block, 3)).T
+            steps = np.arange(start, start + block)
+            window = np.maximum(opening, np.minimum(steps, 8))
+            from_window = (steps >= opening) & (draws[0] > 0.7) & (window > 0)
             
-            # Add note or chord to stream
-            if '.' in next_note:  # It's a chord
-                notes_in_chord = next_note.split('.')
-                chord_notes = []
-                for pitch in notes_in_chord:
-                    try:
-                        n = note.Note(int(pitch))
-                    except:
-                        n = note.Note(pitch)
-                    n.storedInstrument = instrument.Piano()
-                    chord_notes.append(n)
-                new_chord = chord.Chord(chord_notes)
-                new_chord.offset = i * 0.5
-                s.append(new_chord)
-            else:  # It's a single note
-                try:
-                    n = note.Note(next_note)
-                    n.offset = i * 0.5
-                    n.storedInstrument = instrument.Piano()
-                    s.append(n)
-                except:
-                    # Fallback to middle C if note creation fails
-                    n = note.Note('C4')
-                    n.offset = i * 0.5
-                    n.storedInstrument = instrument.Piano()
-                    s.append(n)
+            # Indices into recent + this block
+            source = np.arange(len(recent) + block)
+            picked = source[len(recent):]
+            picked[from_window] -= window[from_window] - (draws[1][from_window] * window[from_window]).astype(int)
             
-            # Show progress
-            if i % 20 == 0:
-                print(f"Generated {i}/{length} notes...")
+            tokens = np.empty(len(recent) + block, dtype=np.int32)
+            tokens[:len(recent)] = recent
+            fresh = steps >= opening
+            tokens[len(recent):][~fresh] = corpus[steps[~fresh]]
+            picks = (draws[2] * len(corpus)).astype(int)
+            tokens[len(recent):][fresh] = corpus[picks[fresh]]
+            
+            # Follow window picks back to the note they copied
+            while True:
+                jumped = source[source]
+                if np.array_equal(jumped, source):
+                    break
+                source = jumped
+            out = tokens[source][len(recent):]
+            recent = np.concatenate([recent, out])[-max(opening, 8):]
+            start += block
+            yield out
+    
+    def sample_best(self, length, rng=None, candidates=None, beams=None):
+        """Draw `length` token ids by beam search over Markov phrases (see scoring.py)
+        
+        Like sample_markov(), but each phrase is the best-scoring of
+        `candidates` drawn for each of `beams` partial pieces, judged on
+        key, range, leaps and repetition.
+        """
+        import numpy as np
+        
+        if rng is None:
+            rng = np.random.default_rng()
+        blocks = self._best_blocks(rng, candidates, beams)
+        parts = [next(blocks)]
+        taken = len(parts[0])
+        while taken < length:
+            parts.append(next(blocks))
+            taken += len(parts[-1])
+        return np.concatenate(parts)[:length]
+    
+    def _best_blocks(self, rng, candidates=None, beams=None):
+        """sample_best() as an endless series of arrays, the opening first"""
+        import numpy as np
+        from scoring import BEAMS, CANDIDATES, PhraseScorer, beam_search
+        
+        if self.model is None:
+            self.train()
+        if self._scorer is None or self._scorer[0] is not self.model:
+            self._scorer = (self.model, PhraseScorer(self.vocab, np.frombuffer(self.tokens, dtype=np.intc)))
+        opening = np.frombuffer(self.tokens, dtype=np.intc)[:self.model.order].astype(np.int32)
+        yield opening
+        yield from beam_search(self.model, self._scorer[1], opening, rng,
+                               candidates or CANDIDATES, beams or BEAMS)
+    
+    def iter_tokens(self, length=None, method='markov', seed=None, block=1024):
+        """Token ids one at a time, in constant memory; endless if `length` is None
+        
+        Random numbers are drawn `block` notes at a time. The notes are the
+        same as generate_ai_music() gives for the same seed and method.
+        """
+        import numpy as np
+        from itertools import chain, islice
+        
+        if not len(self.tokens):
+            self.load_or_create_data(seed=0)  # fixed, so pieces don't depend on which seed came first
+        rng = np.random.default_rng(seed)
+        if method == 'markov':
+            if self.model is None:
+                self.train()
+            opening = self.tokens[:self.model.order].tolist()
+            tokens = chain(opening, self.model.stream(opening, rng, block))
+        elif method == 'pattern':
+            tokens = (token for tokens in self._pattern_blocks(rng, block) for token in tokens.tolist())
+        elif method == 'best':
+            tokens = (token for tokens in self._best_blocks(rng) for token in tokens.tolist())
+        else:
+            raise ValueError(f"Unknown method: {method}")
+        return tokens if length is None else islice(tokens, length)
+    
+    def iter_events(self, length=None, method='markov', seed=None, duration=1.0):
+        """Note/chord events one at a time (see midi_writer.Event); endless if `length` is None"""
+        return self.vocab.iter_events(self.iter_tokens(length, method, seed), duration)
+    
+    def generate_ai_music(self, length=100, method='markov', seed=None):
+        """Generate music using the Markov model ('markov'), the best of several
+        Markov candidates per phrase ('best') or simple patterns ('pattern')
+        
+        The same seed always gives the same piece.
+        """
+        import numpy as np
+        from event_store import EventStore
+        
+        print("Generating AI music...")
+        
+        if not len(self.tokens):
+            with metrics.stage('load_corpus'):
+                self.load_or_create_data(seed=0)  # fixed, so pieces don't depend on which seed came first
+        
+        rng = np.random.default_rng(seed)
+        if method == 'markov':
+            if self.model is None:
+                with metrics.stage('train'):
+                    self.train()
+            with metrics.stage('sample'):
+                tokens = self.sample_markov(length, rng)
+        elif method == 'best':
+            with metrics.stage('sample'):
+                tokens = self.sample_best(length, rng)
+        elif method == 'pattern':
+            with metrics.stage('sample'):
+                tokens = self.sample_tokens(length, rng)
+        else:
+            raise ValueError(f"Unknown method: {method}")
+        print(f"Generated {length} notes...")
+        
+        with metrics.stage('events'):
+            events = EventStore.from_tokens(tokens, self.vocab)
         
         # Save the generated music
-        s.write('midi', fp='ai_music.mid')
+        with metrics.stage('write'):
+            write_midi(events, 'ai_music.mid', use_music21=self.use_music21)
         print("✓ AI music generated: ai_music.mid")
 
-# Create and run the generator
-generator = SimpleMusicGenerator()
-generator.generate_ai_music(length=80)
+def main():
+    print("=== AI Music Generator ===")
+    
+    # Create and run the generator
+    generator = SimpleMusicGenerator()
+    generator.generate_ai_music(length=80)
+    
+    print("🎵 Done! Play 'ai_music.mid' to hear your AI-generated music!")
+    print("You can add MIDI files to the 'midi_files' folder for better results.")
 
-print("🎵 Done! Play 'ai_music.mid' to hear your AI-generated music!")
-print("You can add MIDI files to the 'midi_files' folder for better results.")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -1,13 +1,27 @@
-from flask import Flask, render_template_string, request, send_file, jsonify
 import os
-import numpy as np
-from music21 import note, chord, stream, instrument
+import gzip
+import hashlib
+import io
+import json
+import re
+from array import array
+import secrets
+import tempfile
+import zipfile
+from contextlib import ExitStack
+from collections import deque, namedtuple
+from itertools import chain
+import metrics
+from admission import Admission, Deadline, DeadlineExceeded, Rejected, TooLarge
+from catalogue import FileCatalogue
+from jobs import JobQueue, QueueFull
+from live_model import LiveModel
+from midi_writer import render_midi
+from render_cache import RenderCache
+from vocab import Vocabulary
 import threading
-import webbrowser
 import time
 
-app = Flask(__name__)
-
 # HTML template for the web interface
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -219,9 +233,9 @@ HTML_TEMPLATE = '''
             
             <div class="music-type">
                 <h3>🎧 How to Play</h3>
-                <p>1. Click "Download" next to any file</p>
-                <p>2. Double-click the .mid file to play</p>
-                <p>3. Or upload to <a href="https://onlinesequencer.net/" target="_blank">Online Sequencer</a></p>
+                <p>1. Press play next to any file to hear a preview</p>
+                <p>2. Or click "Download" and double-click the .mid file</p>
+                <p>3. Or upload it to <a href="https://onlinesequencer.net/" target="_blank">Online Sequencer</a></p>
             </div>
         </div>
     </div>
@@ -261,12 +275,11 @@ HTML_TEMPLATE = '''
             const length = document.getElementById('length').value;
             showStatus('🤖 AI is composing...', 'info');
             
-            fetch('/generate/ai?length=' + length)
+            fetch('/jobs/ai?length=' + length, {method: 'POST'})
                 .then(response => response.json())
                 .then(data => {
                     if (data.success) {
-                        showStatus('✅ ' + data.message, 'success');
-                        refreshFiles();
+                        waitForJob(data.job_id);
                     } else {
                         showStatus('❌ ' + data.message, 'error');
                     }
@@ -276,20 +289,40 @@ HTML_TEMPLATE = '''
                 });
         }
         
+        function waitForJob(jobId) {
+            // Long-poll until the job has finished
+            fetch('/jobs/' + jobId + '?wait=10')
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'done') {
+                        showStatus('✅ AI music generated: ' + job.filename, 'success');
+                        refreshFiles();
+                    } else if (job.status === 'failed') {
+                        showStatus('❌ Error: ' + job.error, 'error');
+                    } else {
+                        waitForJob(jobId);
+                    }
+                })
+                .catch(error => {
+                    showStatus('❌ Error: ' + error, 'error');
+                });
+        }
+        
         function refreshFiles() {
             fetch('/files')
                 .then(response => response.json())
-                .then(files => {
+                .then(page => {
                     const fileList = document.getElementById('fileList');
-                    if (files.length === 0) {
+                    if (page.files.length === 0) {
                         fileList.innerHTML = '<p>No music files yet. Generate some music!</p>';
                         return;
                     }
                     
-                    fileList.innerHTML = files.map(file => `
+                    fileList.innerHTML = page.files.map(file => `
                         <div class="file-item">
-                            <span>🎵 ${file}</span>
-                            <a href="/download/${file}" class="btn" download>📥 Download</a>
+                            <span>🎵 ${file.filename}</span>
+                            <audio controls preload="none" src="/preview/${file.filename}"></audio>
+                            <a href="/download/${file.filename}" class="btn" download>📥 Download</a>
                         </div>
                     `).join('');
                 });
@@ -306,79 +339,147 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+# Generated files are named after a hash of their bytes, so they never change
+HASHED_NAME = re.compile(r'_[0-9a-f]{12}\.mid$')
+DOWNLOAD_MAX_AGE = 365 * 24 * 3600
+# Sampling methods /generate/ai accepts (see SimpleMusicGenerator.generate_ai_music)
+AI_METHODS = ('markov', 'best')
+# Longest audio preview rendered, in seconds (about 26 MB of WAV)
+PREVIEW_MAX_SECONDS = 600
+# Model versions kept pinned for batch workers: the active one and the one before
+BATCH_VERSIONS = 2
+
+# A rendered piece: its content-hash filename, the MIDI bytes and the seed it came from
+Piece = namedtuple('Piece', ['filename', 'data', 'seed'], defaults=[None])
+
 class MusicGenerator:
-    def __init__(self):
+    # Fixed pieces, rendered once by warm_up()
+    PRESETS = ['quick_melody', 'chords', 'fast_scale', 'happy_melody', 'sad_melody', 'epic_theme']
+    
+    def __init__(self, use_music21=False, cache_bytes=64 * 1024 * 1024,
+                 max_files=10000, max_bytes=256 * 1024 * 1024, max_age=None, shared=False,
+                 model_path=None, reload_interval=5.0, preview_bytes=128 * 1024 * 1024):
         self.output_dir = "web_music"
+        self.use_music21 = use_music21  # opt in to the slower music21 writer
+        self.vocab = Vocabulary()  # symbols are parsed once, not on every request
+        self.cache = RenderCache(cache_bytes)
+        self.previews = RenderCache(preview_bytes)  # rendered audio, keyed by the MIDI it came from
+        # The corpus-trained model behind the AI pieces; a newly published snapshot is picked up
+        # within `reload_interval` seconds (see live_model.py)
+        self.model = LiveModel(model_path, reload_interval)
+        self._pools = {}  # worker count -> process pool for generate_batch()
+        self._pins = {}  # model version -> snapshot of it that batch workers load, oldest first
+        self._pin_dir = None
+        self._pool_lock = threading.Lock()
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
+        # Oldest files in output_dir are deleted past these limits (None = no limit).
+        # `shared` when several processes write to output_dir (see serve.py)
+        self.catalogue = FileCatalogue(self.output_dir, max_bytes=max_bytes,
+                                       max_files=max_files, max_age=max_age, shared=shared)
+    
+    def warm_up(self):
+        """Render every preset into the cache"""
+        for name in self.PRESETS:
+            getattr(self, f"generate_{name}")()
     
-    def generate_quick_melody(self):
-        s = stream.Stream()
+    def _write(self, symbols, name, cache_key=None, save=True, seed=None, params=None, vocab=None):
+        """Render, cache and save a piece; with `vocab`, `symbols` are ids in it"""
+        from event_store import EventStore
+        
+        data = self.cache.get(cache_key) if cache_key else None
+        if data is None:
+            if callable(symbols):
+                with metrics.stage('build'):
+                    symbols = symbols()  # only build the notes when they aren't cached
+            with metrics.stage('events'):
+                if vocab is None:
+                    vocab, symbols = self.vocab, self.vocab.encode(symbols)
+                events = EventStore.from_tokens(symbols, vocab)
+            with metrics.stage('encode'):
+                data = render_midi(events, use_music21=self.use_music21)
+            if cache_key:
+                self.cache.put(cache_key, data)
+        filename = _filename(name, data)
+        if save:
+            with metrics.stage('save'):
+                self._save(filename, data, params)
+        return Piece(filename, data, seed)
+    
+    def load_piece(self, filename, seed=None):
+        """A saved piece, read back from output_dir (data is None if it has been deleted)"""
+        try:
+            with open(os.path.join(self.output_dir, filename), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        return Piece(filename, data, seed)
+    
+    def preview(self, filename, max_seconds=None):
+        """Audio for a saved piece: (samples, PCM chunks), or None if it has been deleted
+
+        Rendered by synth.py as the chunks are consumed, and cached once
+        they all have been. Raises TooLarge past `max_seconds`.
+        """
+        import synth
+        
+        piece = self.load_piece(filename)
+        if piece.data is None:
+            return None
+        key = RenderCache.key('preview', {'midi': hashlib.sha256(piece.data).hexdigest()})
+        pcm = self.previews.get(key)
+        if pcm is not None:
+            return len(pcm) // 2, iter([pcm])
+        notes = synth.prepare(synth.midi_events(piece.data))
+        samples = synth.total_samples(notes)
+        if max_seconds is not None and samples > max_seconds * synth.SAMPLE_RATE:
+            raise TooLarge(f"Previews are at most {max_seconds:g} seconds long")
+        
+        def render():
+            blocks = []
+            for block in synth.iter_pcm(notes):
+                blocks.append(block)
+                yield block
+            self.previews.put(key, b''.join(blocks))
+        
+        return samples, render()
+    
+    def _save(self, filename, data, params=None):
+        """Write a file atomically (temp file + rename) and add it to the catalogue"""
+        if filename in self.catalogue:
+            return  # names are content hashes, so it's the same file
+        path = os.path.join(self.output_dir, filename)
+        fd, tmp = tempfile.mkstemp(dir=self.output_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.catalogue.add(filename, len(data), params)
+    
+    def generate_quick_melody(self, save=True):
         notes = ['C4', 'E4', 'G4', 'C5', 'E5', 'G4', 'C5', 'E4']
-        for i, pitch in enumerate(notes):
-            n = note.Note(pitch)
-            n.offset = i * 0.5
-            n.storedInstrument = instrument.Piano()
-            s.append(n)
-        filename = "quick_melody.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        return self._write(notes, "quick_melody", RenderCache.key('quick_melody'), save)
     
-    def generate_chords(self):
-        s = stream.Stream()
+    def generate_chords(self, save=True):
         chords = ['C4.E4.G4', 'G4.B4.D5', 'F4.A4.C5', 'C4.E4.G4']
-        for i, chord_name in enumerate(chords):
-            notes_in_chord = chord_name.split('.')
-            chord_notes = []
-            for pitch in notes_in_chord:
-                n = note.Note(pitch)
-                n.storedInstrument = instrument.Piano()
-                chord_notes.append(n)
-            new_chord = chord.Chord(chord_notes)
-            new_chord.offset = i * 2.0
-            s.append(new_chord)
-        filename = "chord_progression.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        return self._write(chords, "chord_progression", RenderCache.key('chords'), save)
     
-    def generate_fast_scale(self):
-        s = stream.Stream()
+    def generate_fast_scale(self, save=True):
         notes = ['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'C5', 'B4', 'A4', 'G4', 'F4', 'E4', 'D4', 'C4']
-        for i, pitch in enumerate(notes):
-            n = note.Note(pitch)
-            n.offset = i * 0.2
-            n.storedInstrument = instrument.Piano()
-            s.append(n)
-        filename = "fast_scale.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        return self._write(notes, "fast_scale", RenderCache.key('fast_scale'), save)
     
-    def generate_happy_melody(self):
-        s = stream.Stream()
+    def generate_happy_melody(self, save=True):
         notes = ['C4', 'E4', 'G4', 'C5', 'E5', 'G5', 'E5', 'C5', 'G4', 'E4', 'C4']
-        for i, pitch in enumerate(notes):
-            n = note.Note(pitch)
-            n.offset = i * 0.4
-            n.storedInstrument = instrument.Piano()
-            s.append(n)
-        filename = "happy_melody.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        return self._write(notes, "happy_melody", RenderCache.key('happy_melody'), save)
     
-    def generate_sad_melody(self):
-        s = stream.Stream()
+    def generate_sad_melody(self, save=True):
         notes = ['C4', 'D4', 'F4', 'G4', 'A4', 'G4', 'F4', 'D4', 'C4']
-        for i, pitch in enumerate(notes):
-            n = note.Note(pitch)
-            n.offset = i * 0.6
-            n.storedInstrument = instrument.Piano()
-            s.append(n)
-        filename = "sad_melody.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        return self._write(notes, "sad_melody", RenderCache.key('sad_melody'), save)
     
-    def generate_epic_theme(self):
-        s = stream.Stream()
+    def generate_epic_theme(self, save=True):
         # Epic chord progression
         chords = [
             'C3.G3.C4.E4',
@@ -386,115 +487,548 @@ class MusicGenerator:
             'A3.E4.A4.C5',
             'F3.C4.F4.A4'
         ]
-        for i, chord_name in enumerate(chords):
-            notes_in_chord = chord_name.split('.')
-            chord_notes = []
-            for pitch in notes_in_chord:
-                n = note.Note(pitch)
-                n.storedInstrument = instrument.Piano()
-                chord_notes.append(n)
-            new_chord = chord.Chord(chord_notes)
-            new_chord.offset = i * 3.0
-            s.append(new_chord)
-        filename = "epic_theme.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        return self._write(chords, "epic_theme", RenderCache.key('epic_theme'), save)
     
-    def generate_ai_music(self, length=50):
-        s = stream.Stream()
-        
-        # AI-like pattern with variations
-        base_pattern = ['C4', 'E4', 'G4', 'C5', 'E5', 'G4', 'C5', 'E4']
-        patterns = [
-            base_pattern,
-            ['G4', 'B4', 'D5', 'G5', 'B4', 'D5', 'G5', 'B4'],
-            ['F4', 'A4', 'C5', 'F5', 'A4', 'C5', 'F5', 'A4']
-        ]
+    def generate_ai_music(self, length=50, save=True, seed=None, deadline=None, method='markov'):
+        """Piece sampled from the corpus model; the same (length, seed) gives the same bytes per model version
         
-        for i in range(length):
-            pattern = patterns[i % len(patterns)]
-            note_index = (i + (i // 8)) % len(pattern)
-            pitch = pattern[note_index]
-            
-            # Add some randomness
-            if np.random.random() < 0.2:
-                pitch = pattern[np.random.randint(len(pattern))]
-            
-            n = note.Note(pitch)
-            n.offset = i * 0.5
-            n.storedInstrument = instrument.Piano()
-            s.append(n)
+        `method` is 'markov', or 'best' for the best of several candidates per
+        phrase (see SimpleMusicGenerator.sample_best). With an admission.Deadline,
+        sampling stops with DeadlineExceeded once it runs out.
+        """
+        model = self.model.current()
+        params = {'length': length, 'model': model.version}
+        if method != 'markov':
+            params['method'] = method  # keeps the keys of plain Markov pieces as they were
+        cache_key = None
+        if seed is None:
+            seed = secrets.randbits(32)
+        else:
+            cache_key = RenderCache.key('ai_music', params, seed)
+        return self._write(lambda: self._ai_tokens(model, length, seed, deadline, method), f"ai_music_{length}notes",
+                           cache_key, save, seed, dict(params, seed=seed), model.generator.vocab)
+    
+    def _ai_tokens(self, model, length, seed, deadline=None, method='markov'):
+        # The ids of generator.generate_ai_music(length, method, seed) in the model's own
+        # vocabulary, drawn a block at a time so the deadline can be checked as they come
+        tokens = array('i')
+        for token in model.generator.iter_tokens(length, method, seed):
+            if deadline is not None and not len(tokens) % 1024:
+                deadline.check()
+            tokens.append(token)
+        return tokens
+    
+    def iter_ai_events(self, length=None, seed=None):
+        """Events for generate_ai_music(length, seed=seed), lazily; endless if `length` is None"""
+        generator = self.model.current().generator
+        return generator.vocab.iter_events(generator.iter_tokens(length, method='markov', seed=seed))
+
+    def generate_batch(self, pieces, workers=None):
+        """Render many AI pieces across a process pool; returns an iterator of them
         
-        filename = f"ai_music_{length}notes.mid"
-        s.write('midi', fp=os.path.join(self.output_dir, filename))
-        return filename
+        `pieces` is an iterable of (length, seed) pairs. Pieces are yielded
+        in order as they finish, with at most two per worker in flight, so
+        memory stays bounded however many are requested. Nothing is saved.
+        
+        Every piece comes from the model version active now, the same bytes
+        generate_ai_music() gives: the workers load a snapshot of it that
+        this process wrote, never the published file, which may have changed.
+        Loading it is checked here, before any piece is.
+        """
+        path = self._pin(self.model.current())
+        workers, pool = self._batch_pool(workers)
+        pool.submit(_load_batch_model, path).result()
+        return self._iter_batch(pool, 2 * workers, pieces, path)
+    
+    def _iter_batch(self, pool, window, pieces, path):
+        in_flight = deque()
+        for length, seed in pieces:
+            in_flight.append(pool.submit(_render_batch_piece, length, seed, path))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+    
+    def _pin(self, model):
+        """Path of a snapshot of `model` (a live_model.ModelVersion) for the batch workers"""
+        from snapshot import save_snapshot
+        
+        with self._pool_lock:
+            path = self._pins.get(model.version)
+            if path is None:
+                if self._pin_dir is None:
+                    self._pin_dir = tempfile.TemporaryDirectory(prefix='music-batch-')
+                path = os.path.join(self._pin_dir.name, f"{model.version}.snap")
+                generator = model.generator
+                save_snapshot(path, generator.vocab, generator.tokens, generator.model)
+                self._pins[model.version] = path
+                while len(self._pins) > BATCH_VERSIONS:
+                    # Workers keep the old versions they have loaded mapped
+                    os.remove(self._pins.pop(next(iter(self._pins))))
+            return path
+
+    def _batch_pool(self, workers=None):
+        """(workers, pool) for generate_batch(); one pool per worker count, the first by default"""
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        with self._pool_lock:
+            if workers is None:
+                workers = next(iter(self._pools), None) or os.cpu_count() or 1
+            pool = self._pools.get(workers)
+            if pool is None:
+                # Not forked: a fork of this threaded server could inherit a lock that
+                # another request thread holds at that moment
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                pool = self._pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            return workers, pool
+
+def _filename(name, data):
+    # Generated files are named after a hash of their bytes (see HASHED_NAME)
+    return f"{name}_{hashlib.sha256(data).hexdigest()[:12]}.mid"
+
+_batch_generators = {}  # snapshot path -> generator, in each pool process
+
+def _batch_generator(path):
+    # Each pool process keeps only models: no catalogue, caches or output directory
+    generator = _batch_generators.get(path)
+    if generator is None:
+        from music_generator import SimpleMusicGenerator
+        
+        generator = SimpleMusicGenerator()
+        generator.load_snapshot(path, verify=False)  # written by the parent a moment ago
+        _batch_generators[path] = generator
+        while len(_batch_generators) > BATCH_VERSIONS:
+            del _batch_generators[next(iter(_batch_generators))]
+    return generator
+
+def _load_batch_model(path):
+    _batch_generator(path)
 
-# Create generator instance
-music_gen = MusicGenerator()
+def _render_batch_piece(length, seed, path):
+    # The bytes MusicGenerator.generate_ai_music(length, seed=seed) renders from the same model
+    from event_store import EventStore
+    
+    if seed is None:
+        seed = secrets.randbits(32)
+    generator = _batch_generator(path)
+    tokens = array('i', generator.iter_tokens(length, 'markov', seed))
+    data = render_midi(EventStore.from_tokens(tokens, generator.vocab))
+    return Piece(_filename(f"ai_music_{length}notes", data), data, seed)
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only stream that hands back whatever was written since the last drain"""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+    
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _positive(value):
+    """A request's count or piece length as an int; ValueError unless a positive integer"""
+    number = int(value)
+    if number < 1 or number != float(value):
+        raise ValueError(f"Bad count or length: {value!r}")
+    return number
+
+
+def _seed(value):
+    """A request's seed as an int (None if absent); ValueError unless a non-negative integer"""
+    if value is None:
+        return None
+    seed = int(value)
+    if seed < 0 or seed != float(value):
+        raise ValueError(f"Bad seed: {value!r}")
+    return seed
+
+def stream_zip(pieces):
+    """Yield a ZIP archive of pieces chunk by chunk, one chunk per piece"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for i, piece in enumerate(pieces):
+            archive.writestr(f"{i:05d}_{piece.filename}", piece.data)
+            yield sink.drain()
+    yield sink.drain()
+
+def ndjson_lines(events, batch=64):
+    """Yield events as newline-delimited JSON, `batch` lines per chunk"""
+    lines = []
+    for event in events:
+        lines.append(json.dumps(event._asdict(), separators=(',', ':')))
+        if len(lines) >= batch:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def create_app(music_gen=None, job_workers=2, max_pending_jobs=32, profiling=False, job_state_dir=None,
+               admission=None):
+    """Build the Flask app around a MusicGenerator (a new one by default)
+    
+    /generate/ai runs in the request thread; /jobs/ai queues the same
+    work on a pool of `job_workers` threads and answers 429 once
+    `max_pending_jobs` are waiting. Piece sizes, large concurrent
+    requests and deadlines are limited by `admission` (an
+    admission.Admission, default limits if None). With `profiling`, adding ?profile=1
+    to any request returns its cProfile report instead of the response.
+    With `job_state_dir`, job states are shared through that directory so
+    any worker process can answer for any job (see serve.py).
+    """
+    import cProfile
+    import pstats
+    import time
+    from flask import (Flask, Response, g, render_template_string, request, send_file, send_from_directory,
+                       jsonify)
+    
+    def respond(piece, message):
+        # ?format=midi returns the file itself instead of a link to it
+        if request.args.get('format') == 'midi':
+            response = send_file(io.BytesIO(piece.data), mimetype='audio/midi',
+                                 as_attachment=True, download_name=piece.filename)
+            if piece.seed is not None:
+                response.headers['X-Seed'] = str(piece.seed)
+            return response
+        result = {'success': True, 'message': message, 'filename': piece.filename}
+        if piece.seed is not None:
+            result['seed'] = piece.seed
+        return jsonify(result)
+    
+    app = Flask(__name__)
+    if music_gen is None:
+        music_gen = MusicGenerator()
+    app.music_gen = music_gen
+    app.admission = admission = admission or Admission()
+    app.config['PROFILING'] = profiling
+    app.jobs = jobs = JobQueue(workers=job_workers, max_pending=max_pending_jobs, state_dir=job_state_dir,
+                               dump=lambda piece: {'filename': piece.filename, 'seed': piece.seed},
+                               load=lambda state: music_gen.load_piece(state['filename'], state['seed']))
+    music_gen.warm_up()
+    
+    # The page has no template variables, so it is rendered and compressed once
+    with app.app_context():
+        page = render_template_string(HTML_TEMPLATE).encode('utf-8')
+    page_gzip = gzip.compress(page, mtime=0)
+    page_etag = hashlib.sha256(page).hexdigest()[:16]
+    page_modified = time.time()
+    
+    @app.before_request
+    def start_timer():
+        g.start = time.perf_counter()
+        if app.config['PROFILING'] and request.args.get('profile'):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response.close()  # it is never sent; runs its call_on_close callbacks
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(40)
+            response = Response(report.getvalue(), mimetype='text/plain')
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        elapsed = time.perf_counter() - g.pop('start', time.perf_counter())
+        metrics.HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method)
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    def client():
+        return request.remote_addr or 'unknown'
+
+    @app.errorhandler(Rejected)
+    def rejected(e):
+        metrics.ADMISSION_REJECTIONS.inc(status=e.status)
+        response = jsonify({'success': False, 'message': str(e)})
+        response.status_code = e.status
+        if e.retry_after is not None:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(e):
+        return jsonify({'success': False, 'message': f'Error: {e}'}), 503
 
-@app.route('/')
-def home():
-    return render_template_string(HTML_TEMPLATE)
+    @app.errorhandler(500)
+    def internal_error(e):
+        error = getattr(e, 'original_exception', None) or e
+        return jsonify({'success': False, 'message': f'Error: {error}'}), 500
 
-@app.route('/generate/<music_type>')
-def generate_music(music_type):
-    try:
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/')
+    def home():
+        gzipped = request.accept_encodings['gzip'] > 0
+        response = Response(page_gzip if gzipped else page, mimetype='text/html')
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f"{page_etag}-gz" if gzipped else page_etag)
+        response.last_modified = page_modified
+        response.cache_control.no_cache = True  # revalidate, so a redeploy shows up at once
+        return response.make_conditional(request)
+
+    @app.route('/generate/<music_type>')
+    def generate_music(music_type):
+        save = request.args.get('format') != 'midi'
         if music_type == 'quick':
-            filename = music_gen.generate_quick_melody()
-            message = f"Quick melody generated: {filename}"
+            piece = music_gen.generate_quick_melody(save)
+            message = f"Quick melody generated: {piece.filename}"
         elif music_type == 'chords':
-            filename = music_gen.generate_chords()
-            message = f"Chord progression generated: {filename}"
+            piece = music_gen.generate_chords(save)
+            message = f"Chord progression generated: {piece.filename}"
         elif music_type == 'fast':
-            filename = music_gen.generate_fast_scale()
-            message = f"Fast scale generated: {filename}"
+            piece = music_gen.generate_fast_scale(save)
+            message = f"Fast scale generated: {piece.filename}"
         elif music_type == 'happy':
-            filename = music_gen.generate_happy_melody()
-            message = f"Happy melody generated: {filename}"
+            piece = music_gen.generate_happy_melody(save)
+            message = f"Happy melody generated: {piece.filename}"
         elif music_type == 'sad':
-            filename = music_gen.generate_sad_melody()
-            message = f"Sad melody generated: {filename}"
+            piece = music_gen.generate_sad_melody(save)
+            message = f"Sad melody generated: {piece.filename}"
         elif music_type == 'epic':
-            filename = music_gen.generate_epic_theme()
-            message = f"Epic theme generated: {filename}"
+            piece = music_gen.generate_epic_theme(save)
+            message = f"Epic theme generated: {piece.filename}"
         else:
-            return jsonify({'success': False, 'message': 'Unknown music type'})
+            return jsonify({'success': False, 'message': 'Unknown music type'}), 404
+        return respond(piece, message)
+
+    def seed_param(default=None):
+        # The request's seed through _seed(), `default` when it has none; ValueError if bad
+        seed = _seed(request.values.get('seed'))
+        return default if seed is None else seed
+
+    @app.route('/generate/ai')
+    def generate_ai_music():
+        length = request.args.get('length', 50, type=int)
+        method = request.args.get('method', 'markov')
+        try:
+            seed = seed_param()
+        except ValueError:
+            return jsonify({'success': False, 'message': 'seed must be a non-negative integer'}), 400
+        if length < 1:
+            return jsonify({'success': False, 'message': 'length must be at least 1'}), 400
+        if method not in AI_METHODS:
+            return jsonify({'success': False, 'message': f"method must be one of {', '.join(AI_METHODS)}"}), 400
+        with admission.admit(client(), [length]) as deadline:
+            piece = music_gen.generate_ai_music(length, save=request.args.get('format') != 'midi',
+                                                seed=seed, deadline=deadline, method=method)
+        message = f"AI music generated with {length} notes: {piece.filename}"
+        return respond(piece, message)
+
+    @app.route('/stream/ai')
+    def stream_ai_music():
+        # One JSON event per line as it is generated; length=0 streams until the client hangs up
+        length = request.args.get('length', 50, type=int)
+        try:
+            seed = seed_param(secrets.randbits(32))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'seed must be a non-negative integer'}), 400
+        if length < 0:
+            return jsonify({'success': False, 'message': 'length must be at least 0'}), 400
+        # Holds its admission slots until the client hangs up or the stream ends;
+        # released at once if anything fails before the response exists
+        with ExitStack() as admitted:
+            admitted.enter_context(admission.admit(client(), [length] if length else None))
+            events = music_gen.iter_ai_events(length or None, seed)
+            response = Response(ndjson_lines(events), mimetype='application/x-ndjson',
+                                headers={'X-Seed': str(seed)})
+            response.call_on_close(admitted.pop_all().close)
+        return response
+
+    def run_ai_job(held, length, seed):
+        # The deadline starts when a job thread picks the job up, not while it waits
+        with held:
+            return music_gen.generate_ai_music(length, seed=seed, deadline=Deadline(admission.deadline))
+
+    @app.route('/jobs/ai', methods=['POST'])
+    def submit_ai_job():
+        length = request.values.get('length', 50, type=int)
+        try:
+            seed = seed_param(secrets.randbits(32))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'seed must be a non-negative integer'}), 400
+        if length < 1:
+            return jsonify({'success': False, 'message': 'length must be at least 1'}), 400
+        admission.check([length])
+        # Counts against the client until the job has finished
+        held = ExitStack()
+        held.enter_context(admission.job(client()))
+        try:
+            job = jobs.submit(run_ai_job, held, length, seed)
+        except QueueFull as e:
+            held.close()
+            return jsonify({'success': False, 'message': f'Server busy: {e}'}), 429
+        return jsonify({'success': True, 'job_id': job.id, 'seed': seed, 'status_url': f'/jobs/{job.id}'}), 202
+
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'message': 'Unknown job'}), 404
+        # ?wait=N long-polls for up to N seconds
+        wait = min(request.args.get('wait', 0, type=float), 30.0)
+        if wait > 0:
+            job.wait(wait)
+        status = job.to_dict()
+        if job.status == 'done':
+            status['filename'] = job.result.filename
+            status['seed'] = job.result.seed
+            status['result_url'] = f'/jobs/{job.id}/result'
+        return jsonify(status)
+
+    @app.route('/jobs/<job_id>/result')
+    def job_result(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'success': False, 'message': 'Unknown job'}), 404
+        if job.status == 'failed':
+            return jsonify({'success': False, 'message': f'Error: {job.error}'}), 500
+        if job.status != 'done':
+            return jsonify({'success': False, 'message': f'Job is {job.status}'}), 409
+        if job.result.data is None:
+            return jsonify({'success': False, 'message': 'Result has expired'}), 410
+        return send_file(io.BytesIO(job.result.data), mimetype='audio/midi',
+                         as_attachment=True, download_name=job.result.filename)
+
+    @app.route('/generate/batch', methods=['POST'])
+    def generate_batch():
+        # {"pieces": [{"length": 50, "seed": 1}, ...]}, or
+        # {"count": N, "length": 50, "seed": S} for seeds S .. S + N - 1
+        # Everything is validated here: once the archive starts, errors can only truncate it
+        params = request.get_json(silent=True) or request.values
+        try:
+            if 'pieces' in params:
+                pieces = [(_positive(p.get('length', 50)), _seed(p.get('seed'))) for p in params['pieces']]
+            else:
+                count = _positive(params.get('count', 10))
+                length = _positive(params.get('length', 50))
+                seed = _seed(params.get('seed'))
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'success': False,
+                            'message': 'Counts and lengths must be positive integers, seeds non-negative'}), 400
+        if 'pieces' not in params:
+            admission.check([length], count)  # before a huge count is turned into a list
+            pieces = [(length, None if seed is None else seed + i) for i in range(count)]
+        # Holds its admission slots until the response is closed, whether or not the
+        # archive is ever sent; pieces are rendered in other processes, so there is
+        # no deadline to check
+        with ExitStack() as admitted:
+            admitted.enter_context(admission.admit(client(), [length for length, _ in pieces]))
+            response = Response(stream_zip(music_gen.generate_batch(pieces)), mimetype='application/zip',
+                                headers={'Content-Disposition': 'attachment; filename=ai_music_batch.zip'})
+            response.call_on_close(admitted.pop_all().close)
+        return response
+
+    @app.route('/admin/model')
+    def model_status():
+        return jsonify(music_gen.model.status())
+
+    @app.route('/admin/model/reload', methods=['POST'])
+    def reload_model():
+        # Picks up a newly published snapshot now instead of at the next check
+        music_gen.model.reload(wait=True)
+        return jsonify(music_gen.model.status())
+
+    @app.route('/admin/admission')
+    def admission_stats():
+        return jsonify(admission.stats())
+
+    @app.route('/cache/stats')
+    def cache_stats():
+        return jsonify(music_gen.cache.stats())
+
+    @app.route('/files')
+    def list_files():
+        # Newest first; pass next_cursor back as ?cursor= for the next page
+        cursor = request.args.get('cursor')
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+        try:
+            files, next_cursor = music_gen.catalogue.page(cursor, limit)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Bad cursor'}), 400
+        response = jsonify({'files': files, 'next_cursor': next_cursor,
+                            'total': len(music_gen.catalogue), 'bytes': music_gen.catalogue.bytes})
+        # The page's auto-refresh then gets a 304 until the listing changes
+        response.add_etag()
+        response.last_modified = music_gen.catalogue.modified
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    @app.route('/download/<filename>')
+    def download_file(filename):
+        # Answers If-None-Match / If-Modified-Since with 304 (ETag and Last-Modified from the file)
+        hashed = HASHED_NAME.search(filename) is not None
+        response = send_from_directory(os.path.abspath(music_gen.output_dir), filename, as_attachment=True,
+                                       download_name=filename, max_age=DOWNLOAD_MAX_AGE if hashed else None)
+        if hashed:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+    def immutable(response, etag):
+        # For hashed names, whose content never changes
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.cache_control.max_age = DOWNLOAD_MAX_AGE
+        return response
+
+    @app.route('/preview/<filename>')
+    def preview_file(filename):
+        # A WAV file, sent as it is rendered; ?format=pcm for the bare samples
+        import synth
         
-        return jsonify({'success': True, 'message': message, 'filename': filename})
+        if not filename.endswith('.mid') or filename not in music_gen.catalogue:
+            return jsonify({'success': False, 'message': 'File not found'}), 404
+        etag = None
+        if HASHED_NAME.search(filename):
+            # The name fixes the content, so a revalidation is answered without reading the file
+            etag = f"{filename}-{request.args.get('format', 'wav')}"
+            if request.if_none_match.contains(etag):
+                return immutable(Response(status=304), etag)
+        preview = music_gen.preview(filename, PREVIEW_MAX_SECONDS)
+        if preview is None:
+            return jsonify({'success': False, 'message': 'File not found'}), 404
+        samples, chunks = preview
+        if request.args.get('format') == 'pcm':
+            headers = {'X-Sample-Rate': str(synth.SAMPLE_RATE), 'X-Channels': '1', 'X-Sample-Format': 's16le'}
+            response = Response(chunks, mimetype='application/octet-stream', headers=headers)
+        else:
+            header = synth.wav_header(samples)
+            response = Response(chain([header], chunks), mimetype='audio/wav',
+                                headers={'Content-Length': str(len(header) + 2 * samples)})
+        if etag is not None:
+            immutable(response, etag)
+        return response.make_conditional(request)
     
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    return app
 
-@app.route('/generate/ai')
-def generate_ai_music():
-    try:
-        length = request.args.get('length', 50, type=int)
-        filename = music_gen.generate_ai_music(length)
-        message = f"AI music generated with {length} notes: {filename}"
-        return jsonify({'success': True, 'message': message, 'filename': filename})
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
-
-@app.route('/files')
-def list_files():
-    try:
-        files = [f for f in os.listdir(music_gen.output_dir) if f.endswith('.mid')]
-        return jsonify(files)
-    except Exception as e:
-        return jsonify([])
-
-@app.route('/download/<filename>')
-def download_file(filename):
-    try:
-        return send_file(
-            os.path.join(music_gen.output_dir, filename),
-            as_attachment=True,
-            download_name=filename
-        )
-    except Exception as e:
-        return f"Error: {str(e)}", 404
+def __getattr__(name):
+    # `music_web.app` (for WSGI servers) is only built on first use, so
+    # importing this module doesn't load Flask or create web_music/
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def open_browser():
+    import webbrowser
     time.sleep(2)
     webbrowser.open('http://127.0.0.1:5000')
 
@@ -509,4 +1043,5 @@ if __name__ == '__main__':
     threading.Thread(target=open_browser).start()
     
     # Run the Flask app
+    app = create_app()
     app.run(debug=True, use_reloader=False)
\ No newline at end of file
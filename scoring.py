@@ -0,0 +1,105 @@
+"""Best-of-K generation: score candidate phrases, keep the best.
+
+A PhraseScorer turns every vocabulary id into a few numbers once (how
+many of its pitch classes fall outside the corpus key, how far its top
+note is outside the corpus range, its top pitch), so a whole (rows x
+notes) array of candidates is scored with lookups and array arithmetic.
+beam_search() builds a piece phrase by phrase: each of its `beams`
+partial pieces gets `candidates` sampled continuations (drawn together
+by the model's generate_batch), and the best-scoring pieces go on.
+"""
+import numpy as np
+
+CANDIDATES = 8  # continuations drawn per beam for every phrase
+BEAMS = 4  # partial pieces kept between phrases
+PHRASE = 16  # notes per phrase
+HORIZON = 8  # phrases searched before the best piece so far is committed
+
+MAJOR_SCALE = (0, 2, 4, 5, 7, 9, 11)
+
+
+def _scale_mask(tonic):
+    return sum(1 << (tonic + step) % 12 for step in MAJOR_SCALE)
+
+
+class PhraseScorer:
+    """Scores rows of token ids against simple music-theory constraints.
+
+    Penalties, each times its weight: pitch classes outside the key
+    (estimated from the corpus tokens), semitones outside the pitch range
+    (the corpus's 5th to 95th percentile unless given), semitones of
+    melodic leaps beyond `max_leap`, and notes that repeat the two before
+    them. For chords the top note is the melody.
+    """
+
+    def __init__(self, vocab, corpus=(), key_weight=1.0, range_weight=0.25, leap_weight=0.25,
+                 max_leap=7, repeat_weight=1.0, low=None, high=None):
+        self.key_weight = key_weight
+        self.range_weight = range_weight
+        self.leap_weight = leap_weight
+        self.max_leap = max_leap
+        self.repeat_weight = repeat_weight
+
+        self.top = np.array([max(pitches) for pitches in vocab.pitches], dtype=np.int64)
+        classes = np.zeros((len(vocab), 12), dtype=np.int64)  # pitch classes sounding in each id
+        for token, pitches in enumerate(vocab.pitches):
+            classes[token, [pitch % 12 for pitch in pitches]] = 1
+
+        corpus = np.asarray(corpus, dtype=np.int64)
+        histogram = np.bincount(corpus, minlength=len(vocab)) @ classes
+        scales = np.array([[_scale_mask(tonic) >> pc & 1 for pc in range(12)] for tonic in range(12)])
+        self.tonic = int(np.argmax(scales @ histogram))  # ties go to the lowest, C without a corpus
+        self.out_of_key = classes @ (1 - scales[self.tonic])
+
+        if low is None or high is None:
+            melody = self.top[corpus] if len(corpus) else np.array([48, 84])
+            low = int(np.percentile(melody, 5)) if low is None else low
+            high = int(np.percentile(melody, 95)) if high is None else high
+        self.low, self.high = low, high
+        self.out_of_range = np.maximum(low - self.top, 0) + np.maximum(self.top - high, 0)
+
+    def __len__(self):
+        return len(self.top)
+
+    def score(self, phrases, previous=None):
+        """Score of every row of `phrases` (higher is better)
+
+        `previous` holds the notes before each row, so leaps and repeats
+        across the phrase boundary count too.
+        """
+        rows = phrases if previous is None else np.concatenate([previous, phrases], axis=1)
+        before = rows.shape[1] - phrases.shape[1]
+        penalty = (self.key_weight * self.out_of_key[phrases].sum(axis=1)
+                   + self.range_weight * self.out_of_range[phrases].sum(axis=1))
+        leaps = np.abs(np.diff(self.top[rows], axis=1))[:, max(before - 1, 0):]
+        penalty += self.leap_weight * np.maximum(leaps - self.max_leap, 0).sum(axis=1)
+        repeats = (rows[:, 2:] == rows[:, 1:-1]) & (rows[:, 2:] == rows[:, :-2])
+        penalty += self.repeat_weight * repeats[:, max(before - 2, 0):].sum(axis=1)
+        return -penalty
+
+
+def beam_search(model, scorer, start=(), rng=None, candidates=CANDIDATES, beams=BEAMS,
+                phrase=PHRASE, horizon=HORIZON):
+    """Token arrays of `horizon` phrases each, without end, continuing from `start`
+
+    After every `horizon` phrases the best piece so far is yielded and
+    the search starts over from its last notes, so the output can be
+    streamed and the first notes don't depend on how many are taken.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    keep = max(model.order, 2)  # notes of context the model and the scorer need
+    tails = np.asarray(start, dtype=np.int64)[-keep:].reshape(1, -1)
+    while True:
+        pieces = np.empty((1, 0), dtype=np.int32)
+        totals = np.zeros(1)
+        for _ in range(horizon):
+            parents = np.repeat(np.arange(len(pieces)), candidates)
+            drawn = model.generate_batch(len(parents), phrase, tails[parents], rng)
+            scores = totals[parents] + scorer.score(drawn, tails[parents])
+            best = np.argsort(-scores, kind='stable')[:beams]
+            pieces = np.concatenate([pieces[parents[best]], drawn[best]], axis=1)
+            tails = np.concatenate([tails[parents[best]], drawn[best]], axis=1)[:, -keep:]
+            totals = scores[best]
+        yield pieces[0]  # best is sorted first
+        tails = tails[:1]
@@ -0,0 +1,220 @@
+"""Production server for the web interface (POSIX only).
+
+    python serve.py --workers 4 --port 8000
+
+The master process builds the app once (music21 imported, presets
+rendered) and then forks the workers, which share that state
+copy-on-write and all accept connections from one listening socket.
+Each worker warms up before it starts accepting, so no request pays for
+a cold start.
+
+    SIGHUP           graceful reload: rebuild the app, start new workers,
+                     then let the old ones finish their requests and exit
+    SIGTERM/SIGINT   graceful shutdown: stop accepting, finish in-flight
+                     requests, exit
+
+Generated files, the file listing (see catalogue.py) and job states are
+shared through web_music/. Each worker writes its metrics to
+web_music/.metrics every few seconds, and /metrics on any worker adds up
+all of them, so a scrape sees the whole server. The render cache is per
+worker. The model snapshot is mapped once by the master; each worker
+swaps in a newly published snapshot on its own (see live_model.py), so
+publishing a model needs no reload.
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import metrics
+
+# Workers that don't exit this long after being asked to are killed
+STOP_TIMEOUT = 30
+# Where workers publish their metrics for each other (see metrics.Registry.share)
+METRICS_DIR = os.path.join('web_music', '.metrics')
+
+
+class _ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = False
+    block_on_close = True  # server_close() waits for in-flight requests
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def build_app(model_path=None):
+    """Everything built here is shared by the workers"""
+    from music_web import MusicGenerator, create_app
+
+    try:
+        import music21  # noqa: F401 -- only needed for the music21 paths, but slow to import
+    except ImportError:
+        pass
+    music_gen = MusicGenerator(shared=True, model_path=model_path)
+    return create_app(music_gen, job_state_dir=os.path.join(music_gen.output_dir, '.jobs'))
+
+
+def warm_up(app):
+    """Per-worker warm-up before accepting traffic"""
+    app.music_gen.warm_up()
+    with app.test_client() as client:
+        client.get('/')
+
+
+def run_worker(app, sock, access_log):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # not ready to drain yet; just exit
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master turns Ctrl+C into SIGTERM
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    warm_up(app)
+    metrics.REGISTRY.share(METRICS_DIR)  # after the warm-up, so its requests don't count
+
+    handler = WSGIRequestHandler if access_log else _QuietHandler
+    # Adopt the inherited socket instead of binding a new one
+    host, port = sock.getsockname()[:2]
+    server = _ThreadedWSGIServer((host, port), handler, bind_and_activate=False)
+    server.socket = sock
+    server.server_name, server.server_port = host, port
+    server.setup_environ()
+    server.set_app(app)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so it can't run on this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever(poll_interval=0.5)
+    server.server_close()
+    app.jobs.shutdown()
+    metrics.REGISTRY.publish()  # so its last requests still count
+
+
+class Master:
+    def __init__(self, host, port, workers, access_log=False, model_path=None):
+        self.workers = workers
+        self.access_log = access_log
+        self.model_path = model_path
+        self.sock = socket.create_server((host, port), backlog=1024)
+        self.app = None
+        self.children = {}  # pid -> generation
+        self.generation = 0
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.sock, self.access_log)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        self.children[pid] = self.generation
+
+    def start_generation(self):
+        self.generation += 1
+        self.app = build_app(self.model_path)
+        gc.collect()
+        gc.freeze()  # keep the collector from touching (and so copying) shared pages
+        for _ in range(self.workers):
+            self.spawn()
+        host, port = self.sock.getsockname()[:2]
+        print(f"🚀 Generation {self.generation}: {self.workers} workers on http://{host}:{port}")
+
+    def stop_children(self, keep=None):
+        """SIGTERM every worker not in generation `keep`; returns {pid: kill deadline}"""
+        deadline = time.monotonic() + STOP_TIMEOUT
+        draining = {}
+        for pid, generation in self.children.items():
+            if generation != keep:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                draining[pid] = deadline
+        return draining
+
+    def reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                break
+            if pid == 0:
+                break
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                print(f"⚠️  Worker {pid} exited unexpectedly (status {status}); restarting")
+                self.spawn()
+
+    def run(self):
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)  # counters start from zero with the server
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        self.start_generation()
+        draining = {}  # pid -> deadline, for workers told to stop
+        stopped = False
+        while self.children:
+            if self.stopping and not stopped:
+                stopped = True
+                draining.update(self.stop_children())
+            elif self.reloading and not self.stopping:
+                self.reloading = False
+                self.start_generation()
+                draining.update(self.stop_children(keep=self.generation))
+                print("🔄 Reloaded; old workers are finishing their requests")
+            time.sleep(0.2)
+            self.reap()
+            now = time.monotonic()
+            for pid, deadline in list(draining.items()):
+                if pid not in self.children:
+                    del draining[pid]
+                elif now > deadline:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        self.sock.close()
+        print("⏹️  Server stopped")
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_reload(self, signum, frame):
+        self.reloading = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--access-log', action='store_true', help='log every request to stderr')
+    parser.add_argument('--model', help='model snapshot to serve and watch for updates '
+                                        '(default: $MUSIC_MODEL or model.snap)')
+    args = parser.parse_args(argv)
+    if not hasattr(os, 'fork'):
+        print("serve.py needs os.fork(); use `python music_web.py` on this platform")
+        return 1
+    print(f"🎵 Starting AI Music Generator with {args.workers} workers...")
+    Master(args.host, args.port, max(1, args.workers), args.access_log, args.model).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
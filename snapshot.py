@@ -0,0 +1,127 @@
+"""Trained generator snapshots: one file, memory-mapped read-only.
+
+    python snapshot.py model.snap --order 2
+
+builds a snapshot from midi_files/ (or the sample data without it).
+
+A snapshot holds the vocabulary, the corpus tokens and the Markov model
+as flat arrays (see markov.FrozenMarkovModel). Loading maps the file and
+wraps the arrays without copying them, so every process that loads the
+same snapshot shares one physical copy through the page cache.
+
+Layout: an 8-byte magic, the schema version, the header length and a
+CRC-32 of everything after them (4-byte little-endian integers each),
+then a JSON header, then the arrays, each aligned to 64 bytes. Files with
+another schema version or a bad checksum raise SnapshotError.
+"""
+import argparse
+import json
+import mmap
+import struct
+import sys
+import zlib
+from collections import namedtuple
+
+MAGIC = b'AIMSNAP\0'
+SCHEMA_VERSION = 1
+ALIGN = 64
+_PREFIX = struct.Struct('<8sIII')  # magic, schema version, header length, CRC-32
+
+# version is the file's checksum in hex, so it changes whenever the content does
+Snapshot = namedtuple('Snapshot', ['vocab', 'tokens', 'model', 'version'])
+
+
+class SnapshotError(ValueError):
+    """A snapshot file that is missing, damaged or from another schema version"""
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def save_snapshot(path, vocab, tokens, model):
+    """Write `vocab`, the corpus `tokens` and a trained MarkovModel to `path`
+
+    The file is written next to `path` and renamed into place, so a
+    process loading it never sees half a snapshot.
+    """
+    import numpy as np
+    from corpus import _replace_atomically
+
+    arrays = dict(model.to_arrays(max(len(vocab), 1)), tokens=np.asarray(tokens, dtype=np.intc))
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        layout[name] = [offset, array.dtype.str, len(array)]
+        offset += array.nbytes
+    header = json.dumps({'order': model.order, 'base': max(len(vocab), 1),
+                         'symbols': vocab.symbols, 'arrays': layout}).encode('utf-8')
+    start = _aligned(_PREFIX.size + len(header))
+
+    body = bytearray(start - _PREFIX.size + offset)
+    body[:len(header)] = header
+    for name, array in arrays.items():
+        at = start - _PREFIX.size + layout[name][0]
+        body[at:at + array.nbytes] = array.tobytes()
+    prefix = _PREFIX.pack(MAGIC, SCHEMA_VERSION, len(header), zlib.crc32(body))
+    _replace_atomically(path, lambda f: (f.write(prefix), f.write(body)))
+
+
+def load_snapshot(path, verify=True):
+    """Map a snapshot read-only; returns Snapshot(vocab, tokens, model, version)
+
+    The token array and the model's arrays are views of the mapping.
+    With `verify`, the checksum is checked first (one pass over the file).
+    """
+    import numpy as np
+    from markov import FrozenMarkovModel
+    from vocab import Vocabulary
+
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"Cannot read snapshot {path}: {e}") from e
+    if len(data) < _PREFIX.size:
+        raise SnapshotError(f"{path} is not a snapshot")
+    magic, version, header_size, checksum = _PREFIX.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not a snapshot")
+    if version != SCHEMA_VERSION:
+        raise SnapshotError(f"{path} has schema version {version}, expected {SCHEMA_VERSION}")
+    if verify and zlib.crc32(memoryview(data)[_PREFIX.size:]) != checksum:
+        raise SnapshotError(f"{path} is damaged (checksum mismatch)")
+    header = json.loads(bytes(data[_PREFIX.size:_PREFIX.size + header_size]))
+
+    start = _aligned(_PREFIX.size + header_size)
+    arrays = {}
+    for name, (offset, dtype, count) in header['arrays'].items():
+        dtype = np.dtype(dtype)
+        if count:
+            arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=start + offset)
+        else:
+            arrays[name] = np.empty(0, dtype=dtype)
+    tokens = arrays.pop('tokens')
+    model = FrozenMarkovModel(header['order'], header['base'], arrays)
+    return Snapshot(Vocabulary(header['symbols']), tokens, model, f"{checksum:08x}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', help='snapshot file to write')
+    parser.add_argument('--order', type=int, default=2, help='Markov model order (default 2)')
+    parser.add_argument('--workers', type=int, help='parser processes (default: one per core)')
+    args = parser.parse_args(argv)
+
+    from music_generator import SimpleMusicGenerator
+
+    generator = SimpleMusicGenerator()
+    generator.load_or_create_data(workers=args.workers, seed=0)
+    generator.train(order=args.order)
+    generator.save_snapshot(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
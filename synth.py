@@ -0,0 +1,118 @@
+"""Offline synthesizer for in-browser previews.
+
+Every note is a few sine partials under an attack/decay/release
+envelope. Audio is rendered in blocks: for each block the notes that
+sound in it are stacked into one (notes x samples) array, so all voices
+are computed and mixed by a handful of NumPy operations per block
+rather than sample by sample. Output is 16-bit mono PCM, optionally
+with a WAV header, produced block by block so it can be streamed.
+"""
+import struct
+from collections import namedtuple
+
+from midi_writer import DEFAULT_TEMPO, Event
+
+SAMPLE_RATE = 22050
+BLOCK = 4096  # samples per rendered block
+ATTACK = 0.005  # seconds
+DECAY = 1.2  # seconds for a held note to fall to 1/e
+RELEASE = 0.08  # seconds from note-off to silence
+PARTIALS = (1.0, 0.5, 0.25)  # relative strength of the 1st, 2nd, 3rd harmonic
+GAIN = 0.3  # before the soft clip; leaves room for a few loud voices
+
+# Every note, as arrays sorted by start (times in samples)
+Notes = namedtuple('Notes', ['starts', 'ends', 'freqs', 'amps'])
+
+
+def prepare(events, sample_rate=SAMPLE_RATE, tempo=DEFAULT_TEMPO):
+    """Notes from midi_writer events (or an EventStore), played at `tempo` µs per quarter"""
+    import numpy as np
+
+    per_quarter = tempo / 1e6 * sample_rate
+    rows = [(e.onset, e.onset + e.duration, pitch, e.velocity) for e in events for pitch in e.pitches]
+    table = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    table = table[np.argsort(table[:, 0], kind='stable')]
+    return Notes(np.rint(table[:, 0] * per_quarter).astype(np.int64),
+                 np.rint(table[:, 1] * per_quarter).astype(np.int64),
+                 440.0 * 2.0 ** ((table[:, 2] - 69) / 12),
+                 table[:, 3] / 127)
+
+
+def midi_events(data):
+    """midi_writer events for the notes of an SMF file's bytes (onsets in quarters)"""
+    from midi_reader import read_smf
+
+    ticks_per_quarter, tracks = read_smf(data)
+    events = []
+    for notes, _ in tracks:
+        sounding = {}  # (pitch, channel) -> [(on tick, velocity)], oldest first
+        for tick, pitch, channel, velocity, is_off in notes:
+            if not is_off:
+                sounding.setdefault((pitch, channel), []).append((tick, velocity))
+            elif sounding.get((pitch, channel)):
+                on, velocity = sounding[pitch, channel].pop(0)
+                events.append(Event(on / ticks_per_quarter, (tick - on) / ticks_per_quarter,
+                                    (pitch,), velocity, 0))
+    events.sort(key=lambda e: e.onset)
+    return events
+
+
+def total_samples(notes, sample_rate=SAMPLE_RATE):
+    if not len(notes.ends):
+        return 0
+    return int(notes.ends.max()) + int(RELEASE * sample_rate)
+
+
+def iter_pcm(notes, sample_rate=SAMPLE_RATE, block=BLOCK):
+    """16-bit little-endian PCM for `notes`, as one bytes object per block"""
+    import numpy as np
+
+    release = int(RELEASE * sample_rate)
+    stops = notes.ends + release
+    # Every note before index i has stopped by latest_stop[i - 1]
+    latest_stop = np.maximum.accumulate(stops) if len(stops) else stops
+    partials = np.array(PARTIALS)
+    # Partials above the Nyquist frequency would alias
+    weights = partials[None, :] * (notes.freqs[:, None] * np.arange(1, len(PARTIALS) + 1) < sample_rate / 2)
+    end = total_samples(notes, sample_rate)
+    for first in range(0, end, block):
+        last = min(first + block, end)
+        low = int(np.searchsorted(latest_stop, first, side='right'))
+        high = int(np.searchsorted(notes.starts, last, side='left'))
+        active = np.arange(low, high)
+        active = active[stops[low:high] > first]
+        if not len(active):
+            yield bytes(2 * (last - first))
+            continue
+
+        since = np.arange(first, last)[None, :] - notes.starts[active, None]  # samples since note-on
+        seconds = since / sample_rate
+        held = (notes.ends[active] - notes.starts[active])[:, None]
+        envelope = np.minimum(seconds / ATTACK, 1.0) * np.exp(-seconds / DECAY)
+        envelope *= np.clip(1.0 - (since - held) / release, 0.0, 1.0)
+        envelope[since < 0] = 0.0
+
+        phase = (2 * np.pi) * notes.freqs[active, None] * seconds
+        wave = np.zeros_like(phase)
+        for harmonic in range(len(PARTIALS)):
+            wave += weights[active, harmonic, None] * np.sin((harmonic + 1) * phase)
+        mix = (notes.amps[active, None] * envelope * wave).sum(axis=0)
+        yield (np.tanh(mix * GAIN) * 32767).astype('<i2').tobytes()
+
+
+def wav_header(samples, sample_rate=SAMPLE_RATE):
+    """The 44-byte header of a mono 16-bit WAV file holding `samples` samples"""
+    size = 2 * samples
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size, b'WAVE', b'fmt ', 16, 1, 1,
+                       sample_rate, 2 * sample_rate, 2, 16, b'data', size)
+
+
+def iter_wav(notes, sample_rate=SAMPLE_RATE, block=BLOCK):
+    """A WAV file for `notes`, header first, then one block at a time"""
+    yield wav_header(total_samples(notes, sample_rate), sample_rate)
+    yield from iter_pcm(notes, sample_rate, block)
+
+
+def render_wav(events, sample_rate=SAMPLE_RATE):
+    """A whole WAV file for midi_writer events"""
+    return b''.join(iter_wav(prepare(events, sample_rate), sample_rate))
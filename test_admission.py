@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from admission import Admission, ClientBusy, Invalid, TooLarge
+from music_web import create_app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = create_app(admission=Admission(max_notes=1000, max_batch_notes=2000, expensive_notes=500,
+                                         max_expensive=0))
+    yield app
+    app.jobs.shutdown()
+
+
+def test_check_refuses_empty_pieces():
+    admission = Admission(max_notes=1000, max_batch_notes=2000)
+    with pytest.raises(Invalid):
+        admission.check([1000, -100000])
+    with pytest.raises(TooLarge):
+        admission.check([1000], copies=3)
+    assert admission.check([1000], copies=2) == 2000
+
+
+def test_negative_length_cannot_offset_a_batch(app):
+    pieces = [{'length': 1000}] * 5 + [{'length': -100000}]
+    response = app.test_client().post('/generate/batch', json={'pieces': pieces})
+    assert response.status_code == 400
+
+
+def test_count_checked_before_pieces_are_built(app):
+    client = app.test_client()
+    assert client.post('/generate/batch', json={'count': 10 ** 12, 'length': 1}).status_code == 413
+    assert client.post('/generate/batch', json={'count': 0, 'length': 1}).status_code == 400
+    assert client.post('/generate/batch', json={'count': 2, 'length': 2.5}).status_code == 400
+
+
+def test_jobs_counted_per_client_until_they_finish(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = create_app(admission=Admission(per_client_jobs=2))
+    release = threading.Event()
+    generate = app.music_gen.generate_ai_music
+
+    def blocked(*args, **kwargs):
+        release.wait()
+        return generate(*args, **kwargs)
+
+    monkeypatch.setattr(app.music_gen, 'generate_ai_music', blocked)
+    client = app.test_client()
+    try:
+        statuses = [client.post('/jobs/ai', data={'length': 10, 'seed': i}).status_code for i in range(3)]
+        assert statuses == [202, 202, 429]
+        assert app.admission.stats()['jobs'] == 2
+    finally:
+        release.set()
+        app.jobs.shutdown()
+    assert app.admission.stats()['jobs'] == 0
+
+
+def test_endless_stream_takes_a_slot(app):
+    client = app.test_client()
+    assert client.get('/stream/ai?length=-1').status_code == 400
+    assert client.get('/stream/ai?length=0', buffered=False).status_code == 503  # max_expensive=0
+    assert client.get('/stream/ai?length=10').status_code == 200
+
+
+def test_failing_stream_releases_its_slot(app, monkeypatch):
+    app.admission.max_expensive = 1
+
+    def broken(length=None, seed=None):
+        raise ValueError("no model")
+
+    monkeypatch.setattr(app.music_gen, 'iter_ai_events', broken)
+    assert app.test_client().get('/stream/ai?length=0').status_code == 500
+    assert app.admission.stats()['expensive'] == 0
+
+
+def test_endless_stream_releases_its_slot_on_close(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = create_app(admission=Admission(per_client=1))
+    try:
+        client = app.test_client()
+        response = client.get('/stream/ai?length=0', buffered=False)
+        assert response.status_code == 200
+        assert client.get('/stream/ai?length=0', buffered=False).status_code == 429
+        response.close()
+        assert app.admission.stats()['expensive'] == 0
+    finally:
+        app.jobs.shutdown()
+
+
+def test_job_places_released_when_refused():
+    admission = Admission(per_client_jobs=1)
+    with admission.job('a'):
+        with pytest.raises(ClientBusy):
+            with admission.job('a'):
+                pass
+        with admission.job('b'):
+            assert admission.stats()['jobs'] == 2
+    assert admission.stats()['jobs'] == 0
@@ -0,0 +1,16 @@
+import json
+import os
+
+from bulk_render import MANIFEST, bulk_render
+from music_generator import SimpleMusicGenerator
+
+
+def test_files_match_generate_ai_music(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    bulk_render(3, (40, 40), seed=5, output='library', workers=1)
+    with open(os.path.join('library', MANIFEST), encoding='utf-8') as f:
+        filenames = [json.loads(line)['filename'] for line in f]
+    for seed, filename in zip(range(5, 8), filenames):
+        SimpleMusicGenerator().generate_ai_music(40, seed=seed)
+        with open('ai_music.mid', 'rb') as expected, open(os.path.join('library', filename), 'rb') as rendered:
+            assert rendered.read() == expected.read()
@@ -0,0 +1,40 @@
+import os
+
+from catalogue import FileCatalogue
+
+
+def _write(directory, names, mtime_ns):
+    for name in names:
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(b'MThd')
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _all_pages(catalogue, limit):
+    names, cursor = [], None
+    while True:
+        entries, cursor = catalogue.page(cursor, limit)
+        names += [entry['filename'] for entry in entries]
+        if cursor is None:
+            return names
+
+
+def test_paging_keeps_files_with_equal_mtimes(tmp_path):
+    # Coarse timestamps: whole seconds, several files per second
+    names = [f"f{i:02d}.mid" for i in range(10)]
+    for second, group in enumerate([names[:4], names[4:7], names[7:]]):
+        _write(tmp_path, group, (1_700_000_000 + second) * 10**9)
+    catalogue = FileCatalogue(str(tmp_path))
+    for limit in (1, 2, 3, 50):
+        assert _all_pages(catalogue, limit) == names[::-1]
+
+
+def test_cursor_survives_new_files(tmp_path):
+    _write(tmp_path, ['a.mid', 'b.mid', 'c.mid'], 1_700_000_000 * 10**9)
+    catalogue = FileCatalogue(str(tmp_path))
+    first, cursor = catalogue.page(None, 2)
+    _write(tmp_path, ['d.mid'], 1_700_000_001 * 10**9)
+    catalogue.add('d.mid', 4)
+    rest, _ = catalogue.page(cursor, 2)
+    assert [e['filename'] for e in first + rest] == ['c.mid', 'b.mid', 'a.mid']
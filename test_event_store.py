@@ -0,0 +1,57 @@
+import pytest
+
+from event_store import ChordTable, EventStore
+from midi_writer import encode_midi
+from vocab import Vocabulary
+
+
+@pytest.fixture
+def vocab():
+    return Vocabulary(['C4', 'E4', 'G4.B4.D5', 'A0', 'C8'])
+
+
+@pytest.fixture
+def store(vocab):
+    return EventStore.from_tokens([0, 1, 2, 2, 0, 1], vocab, chords=ChordTable())
+
+
+def test_from_tokens_matches_vocabulary_events(vocab, store):
+    assert list(store) == vocab.events([0, 1, 2, 2, 0, 1])
+    assert encode_midi(store) == encode_midi(vocab.events([0, 1, 2, 2, 0, 1]))
+    assert store[2] == vocab.events([2])[0]._replace(onset=2.0)
+
+
+def test_transpose(store):
+    up = store.transpose(5)
+    assert [e.pitches for e in up] == [tuple(p + 5 for p in e.pitches) for e in store]
+    assert [e.onset for e in up] == [e.onset for e in store]
+    assert list(up.transpose(-5)) == list(store)
+    assert list(store.transpose(0)) == list(store)
+    assert len(store.chords) == 8  # the 5 vocabulary entries, then the 3 used ones moved once
+
+
+def test_transpose_out_of_range(vocab):
+    store = EventStore.from_tokens([3, 4], vocab)
+    with pytest.raises(ValueError):
+        store.transpose(-22)
+    with pytest.raises(ValueError):
+        store.transpose(20)
+    assert list(store.transpose(0)) == list(store)
+
+
+def test_stretch(store):
+    slow = store.stretch(2)
+    assert [(e.onset, e.duration) for e in slow] == [(2.0 * i, 2.0) for i in range(6)]
+    assert [e.pitches for e in slow] == [e.pitches for e in store]
+    assert [e.onset for e in store] == [float(i) for i in range(6)]  # unchanged
+    for factor in (0, -1):
+        with pytest.raises(ValueError):
+            store.stretch(factor)
+
+
+def test_slice_time(store):
+    middle = store.slice_time(2, 4)
+    assert list(middle) == [e._replace(onset=e.onset - 2) for e in store if 2 <= e.onset < 4]
+    assert [e.onset for e in store.slice_time(4)] == [0.0, 1.0]
+    assert len(store.slice_time(10)) == 0
+    assert [e.onset for e in store] == [float(i) for i in range(6)]  # unchanged
@@ -0,0 +1,67 @@
+import os
+import time
+
+import pytest
+
+from live_model import LiveModel
+from music_generator import SimpleMusicGenerator
+
+
+def _publish(path, order):
+    generator = SimpleMusicGenerator()
+    generator.load_or_create_data(seed=0)
+    generator.train(order=order)
+    tmp = f"{path}.new"
+    generator.save_snapshot(tmp)
+    os.replace(tmp, path)  # how a new model is published
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'model.snap')
+
+
+def test_trains_without_a_snapshot(path):
+    model = LiveModel(path, interval=None)
+    assert model.current().source == 'training'
+    assert model.current().version.startswith('trained-')
+
+
+def test_new_snapshot_swapped_in(path):
+    model = LiveModel(path, interval=None)
+    old = model.current()
+    _publish(path, order=1)
+    model.reload(wait=True)
+    new = model.current()
+    assert new.source == path
+    assert new.version != old.version
+    assert model.reloads == 1 and model.last_error is None
+    assert new.generator.model.order == 1
+    # A request that took the old version before the swap still finishes with it
+    assert len(list(old.generator.iter_tokens(20, seed=1))) == 20
+
+
+def test_bad_snapshot_keeps_the_old_model(path):
+    _publish(path, order=2)
+    model = LiveModel(path, interval=None)
+    version = model.current().version
+    with open(f"{path}.new", 'wb') as f:
+        f.write(b'AIMSNAP\0' + os.urandom(200))
+    os.replace(f"{path}.new", path)
+    model.reload(wait=True)
+    assert model.current().version == version
+    assert model.last_error is not None and model.reloads == 0
+    assert model.status()['last_error'] == model.last_error
+    assert len(list(model.current().generator.iter_tokens(20, seed=1))) == 20
+
+
+def test_checked_every_interval(path):
+    _publish(path, order=2)
+    model = LiveModel(path, interval=0)
+    version = model.current().version
+    _publish(path, order=1)
+    deadline = time.monotonic() + 10
+    while model.current().version == version and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert model.current().version != version
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from markov import AliasTable, MarkovModel
+
+
+def _frequencies(table, draws=200000, seed=0):
+    u = np.random.default_rng(seed).random((draws, 2))
+    counts = {}
+    for u1, u2 in u.tolist():
+        outcome = table.draw(u1, u2)
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return {outcome: count / draws for outcome, count in counts.items()}
+
+
+def test_alias_table_matches_its_weights():
+    weights = {'a': 1, 'b': 2, 'c': 3, 'd': 10, 'e': 0.5}
+    frequencies = _frequencies(AliasTable(list(weights), list(weights.values())))
+    total = sum(weights.values())
+    for outcome, weight in weights.items():
+        assert frequencies[outcome] == pytest.approx(weight / total, abs=0.005)
+
+
+def test_alias_table_single_outcome():
+    table = AliasTable([7], [3])
+    assert {table.draw(u, 1 - u) for u in (0.0, 0.3, 0.999)} == {7}
+
+
+def test_back_off_to_the_longest_seen_context():
+    model = MarkovModel(order=2).update([0, 1, 2, 0, 1, 3, 4, 4])
+    assert set(model.table([0, 1]).outcomes) == {2, 3}  # seen as a pair
+    assert set(model.table([4, 1]).outcomes) == {2, 3}  # (4, 1) unseen: after 1
+    assert set(model.table([4, 9]).outcomes) == {0, 1, 2, 3, 4}  # 9 unseen: unigrams
+    assert set(model.table([]).outcomes) == {0, 1, 2, 3, 4}
+
+
+def test_untrained_model_refuses():
+    with pytest.raises(ValueError):
+        MarkovModel().table([1])
+
+
+def test_frozen_draws_match_live_draws():
+    tokens = np.random.default_rng(1).integers(0, 12, 3000)
+    model = MarkovModel(order=3).update(tokens)
+    for start in ([], [5], [3, 7, 11], [40, 41]):  # 40 and 41 are never seen
+        live = model.generate(500, start=start, rng=np.random.default_rng(2))
+        frozen = model.frozen().generate(500, start=start, rng=np.random.default_rng(2))
+        assert np.array_equal(live, frozen)
+
+
+def test_transitions_follow_the_counts():
+    model = MarkovModel(order=1).update([0, 1] * 300 + [0, 2] * 100)
+    drawn = model.generate(20000, start=[1], rng=np.random.default_rng(3))
+    after_zero = drawn[1:][drawn[:-1] == 0]
+    assert np.mean(after_zero == 1) == pytest.approx(0.75, abs=0.02)
@@ -0,0 +1,49 @@
+import warnings
+from collections import Counter
+
+import pytest
+
+from check_midi_reader import humanized_midi
+from midi_reader import read_smf, read_tokens, tokenize_smf
+from midi_writer import encode_midi
+from vocab import Vocabulary
+
+
+def test_notes_and_chords_read_back():
+    vocab = Vocabulary(['C4', 'B-3', 'F#5', 'C4.E4.G4', 'G3.B3.D4', 'C4'])
+    data = encode_midi(vocab.events([0, 1, 2, 3, 4, 0]))
+    assert tokenize_smf(data) == ['C4', 'B-3', 'F#5', '0.4.7', '7.11.2', 'C4']
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'RIFF\x00\x00\x00\x06\x00\x01\x00\x01\x01\xe0',
+    b'MThd\x00\x00\x00\x06\x00\x02\x00\x01\x01\xe0MTrk\x00\x00\x00\x00',  # format 2
+    b'MThd\x00\x00\x00\x06\x00\x01\x00\x01\x01\xe0',  # no track chunk
+    encode_midi(Vocabulary(['C4']).events([0] * 8))[:40],  # cut mid-track
+])
+def test_bad_files_raise_value_error(data):
+    with pytest.raises(ValueError):
+        read_smf(data)
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.mid'
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        read_tokens(str(path))
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_humanized_files_match_music21(tmp_path, seed):
+    pytest.importorskip('music21')
+    from corpus import parse_with_music21
+
+    path = tmp_path / f'humanized_{seed}.mid'
+    path.write_bytes(humanized_midi(seed))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = parse_with_music21(str(path))
+    tokens = read_tokens(str(path))
+    # Parts may interleave differently (see midi_reader); the symbols may not differ
+    assert Counter(tokens) == Counter(expected)
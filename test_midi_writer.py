@@ -0,0 +1,30 @@
+import pytest
+
+from midi_writer import render_midi
+from vocab import Vocabulary
+
+pytest.importorskip('music21')
+
+
+def _same_as_music21(events):
+    return render_midi(events) == render_midi(events, use_music21=True)
+
+
+def test_notes_and_chords_match_music21():
+    vocab = Vocabulary(['C4', 'F#5', 'B-3', 'C4.E4.G4', '0.4.7', 'G2.D3', 'A0', 'C8'])
+    assert _same_as_music21(vocab.events(range(len(vocab))))
+    assert _same_as_music21(vocab.events([3, 3, 0, 4, 1, 5, 2] * 40, duration=0.5))
+    assert _same_as_music21(vocab.events([]))
+
+
+def test_presets_match_music21(tmp_path, monkeypatch):
+    from music_web import MusicGenerator
+
+    monkeypatch.chdir(tmp_path)
+    direct = MusicGenerator(cache_bytes=0)
+    through_music21 = MusicGenerator(use_music21=True, cache_bytes=0)
+    for name in MusicGenerator.PRESETS + ['ai_music']:
+        pieces = [getattr(generator, f'generate_{name}')(save=False).data if name != 'ai_music'
+                  else generator.generate_ai_music(60, save=False, seed=9).data
+                  for generator in (direct, through_music21)]
+        assert pieces[0] == pieces[1], name
@@ -0,0 +1,132 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from music_generator import SimpleMusicGenerator
+from music_web import MusicGenerator, create_app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = create_app()
+    yield app
+    app.jobs.shutdown()
+
+
+@pytest.mark.parametrize('seed', ['-1', '1.5', 'abc'])
+def test_bad_seeds_refused(app, seed):
+    client = app.test_client()
+    assert client.get(f'/generate/ai?length=10&seed={seed}').status_code == 400
+    assert client.get(f'/stream/ai?length=10&seed={seed}').status_code == 400
+    assert client.post('/jobs/ai', data={'length': 10, 'seed': seed}).status_code == 400
+    assert app.admission.stats()['jobs'] == 0
+
+
+def test_seed_repeats_piece(app):
+    client = app.test_client()
+    first = client.get('/generate/ai?length=10&seed=3&format=midi')
+    assert first.status_code == 200
+    assert client.get('/generate/ai?length=10&seed=3&format=midi').data == first.data
+
+
+def test_batch_pieces_match_generate_ai(app):
+    client = app.test_client()
+    kept = set(os.listdir('web_music'))
+    response = client.post('/generate/batch', json={'count': 3, 'length': 20, 'seed': 4})
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    for seed, name in zip(range(4, 7), archive.namelist()):
+        piece = client.get(f'/generate/ai?length=20&seed={seed}&format=midi')
+        assert archive.read(name) == piece.data
+    assert kept <= set(os.listdir('web_music'))
+
+
+def _batch_matches_generate_ai(client, seed=4):
+    archive = zipfile.ZipFile(io.BytesIO(
+        client.post('/generate/batch', json={'count': 2, 'length': 20, 'seed': seed}).data))
+    return all(archive.read(name) == client.get(f'/generate/ai?length=20&seed={s}&format=midi').data
+               for s, name in zip(range(seed, seed + 2), archive.namelist()))
+
+
+def test_batch_follows_the_active_model(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    music_gen = MusicGenerator(model_path=str(tmp_path / 'model.snap'), reload_interval=None)
+    app = create_app(music_gen)
+    client = app.test_client()
+    try:
+        assert _batch_matches_generate_ai(client)  # the trained model; the pool starts now
+
+        (tmp_path / 'model.snap').write_bytes(b'not a snapshot')
+        music_gen.model.reload(wait=True)
+        assert music_gen.model.last_error is not None
+        assert _batch_matches_generate_ai(client)
+
+        other = SimpleMusicGenerator()
+        other.load_or_create_data(seed=0)
+        other.train(order=1)
+        other.save_snapshot(str(tmp_path / 'model.snap'))
+        music_gen.model.reload(wait=True)
+        assert music_gen.model.current().source != 'training'
+        assert _batch_matches_generate_ai(client)
+    finally:
+        app.jobs.shutdown()
+
+
+def test_preview_only_for_catalogued_midi(app):
+    client = app.test_client()
+    for name in ('..', '.catalogue.jsonl', 'missing_0123456789ab.mid'):
+        assert client.get(f'/preview/{name}').status_code == 404
+    filename = app.music_gen.generate_quick_melody().filename
+    assert client.get(f'/preview/{filename}?format=pcm').status_code == 200
+
+
+def test_preview_revalidated_without_rendering(app, monkeypatch):
+    client = app.test_client()
+    filename = app.music_gen.generate_quick_melody().filename
+    etag = client.get(f'/preview/{filename}').headers['ETag']
+
+    def unused(*args):
+        raise AssertionError("previewed again")
+
+    monkeypatch.setattr(app.music_gen, 'preview', unused)
+    response = client.get(f'/preview/{filename}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+def test_home_page_revalidates(app):
+    client = app.test_client()
+    plain = client.get('/')
+    gzipped = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['ETag'] != plain.headers['ETag']
+    for response, encoding in ((plain, 'identity'), (gzipped, 'gzip')):
+        again = client.get('/', headers={'Accept-Encoding': encoding, 'If-None-Match': response.headers['ETag']})
+        assert again.status_code == 304 and again.data == b''
+    since = client.get('/', headers={'If-Modified-Since': plain.headers['Last-Modified']})
+    assert since.status_code == 304
+    assert client.get('/', headers={'If-None-Match': '"stale"'}).status_code == 200
+
+
+def test_file_listing_revalidates_until_it_changes(app):
+    client = app.test_client()
+    etag = client.get('/files').headers['ETag']
+    assert client.get('/files', headers={'If-None-Match': etag}).status_code == 304
+    client.get('/generate/ai?length=10&seed=1')
+    changed = client.get('/files', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_download_revalidates(app):
+    client = app.test_client()
+    filename = app.music_gen.generate_quick_melody().filename
+    response = client.get(f'/download/{filename}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    response.close()
+    assert client.get(f'/download/{filename}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    since = client.get(f'/download/{filename}', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert since.status_code == 304
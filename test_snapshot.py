@@ -0,0 +1,33 @@
+import numpy as np
+
+from markov import FrozenMarkovModel, MarkovModel
+from snapshot import load_snapshot, save_snapshot
+from vocab import Vocabulary
+
+
+def _trained(order=2):
+    vocab = Vocabulary(['C4', 'D4', 'E4', 'F4', 'G4', 'C4.E4.G4'])
+    rng = np.random.default_rng(0)
+    tokens = rng.integers(0, len(vocab), 500).tolist()
+    model = MarkovModel(order)
+    model.update(tokens)
+    return vocab, tokens, model
+
+
+def test_save_after_load(tmp_path):
+    vocab, tokens, model = _trained()
+    save_snapshot(tmp_path / 'first.snap', vocab, tokens, model)
+    loaded = load_snapshot(tmp_path / 'first.snap')
+    save_snapshot(tmp_path / 'second.snap', loaded.vocab, loaded.tokens, loaded.model)
+    assert load_snapshot(tmp_path / 'second.snap').version == loaded.version
+
+
+def test_frozen_repacked_for_a_larger_vocabulary():
+    vocab, tokens, model = _trained()
+    frozen = model.frozen()
+    base = frozen.base + 5
+    repacked = FrozenMarkovModel(model.order, base, frozen.to_arrays(base))
+    assert np.array_equal(repacked.generate(200, start=tokens[:2], rng=np.random.default_rng(1)),
+                          frozen.generate(200, start=tokens[:2], rng=np.random.default_rng(1)))
+    for k in range(model.order + 1):
+        assert np.array_equal(repacked.arrays[f'keys{k}'], model.to_arrays(base)[f'keys{k}'])
@@ -0,0 +1,71 @@
+import threading
+from array import array
+
+from midi_writer import make_event, parse_symbol
+
+# Middle C, what the generators have always used for notes they can't read
+FALLBACK_PITCHES = (60,)
+
+
+class Vocabulary:
+    """Interned note/chord symbols.
+
+    Each distinct symbol ('C4', 'C4.E4.G4', '0.4.7') gets a small integer
+    id the first time it is seen, and its MIDI pitches are parsed once and
+    kept in ``pitches`` so generation only needs a table lookup.
+    """
+
+    def __init__(self, symbols=()):
+        self.symbols = []
+        self.pitches = []
+        self._ids = {}
+        self._lock = threading.Lock()
+        for symbol in symbols:
+            self.intern(symbol)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self._ids
+
+    def intern(self, symbol):
+        """Return the id for a symbol, adding it if it is new; safe across threads"""
+        token = self._ids.get(symbol)
+        if token is None:
+            symbol = str(symbol)
+            try:
+                pitches = parse_symbol(symbol)
+            except ValueError:
+                pitches = FALLBACK_PITCHES
+            with self._lock:
+                token = self._ids.get(symbol)
+                if token is None:
+                    token = len(self.symbols)
+                    # pitches before the id is published, so readers never see an id without them
+                    self.pitches.append(pitches)
+                    self.symbols.append(symbol)
+                    self._ids[symbol] = token
+        return token
+
+    def encode(self, symbols):
+        """Intern a sequence of symbols into a compact int array"""
+        return array('i', map(self.intern, symbols))
+
+    def decode(self, tokens):
+        return [self.symbols[token] for token in tokens]
+
+    def events(self, tokens, duration=1.0):
+        """Back-to-back events for a token sequence
+
+        This matches what music21's ``Stream.append`` does with our notes:
+        each one is placed at the end of the stream, so the files are
+        consecutive quarter notes whatever offset was set beforehand.
+        """
+        return list(self.iter_events(tokens, duration))
+
+    def iter_events(self, tokens, duration=1.0):
+        """Like events(), but lazily, for token streams of any length"""
+        pitches = self.pitches
+        for i, token in enumerate(tokens):
+            yield make_event(pitches[token], onset=i * duration, duration=duration)